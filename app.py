@@ -1,28 +1,180 @@
 # Itza Yerba Mate - Waitlist Signup
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, make_response
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
 from datetime import datetime
 import requests
 import traceback
 import base64
+import hashlib
 import json
 import time
 import csv
+import io
+import zlib
+import threading
+import atexit
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 # Import the centralized email utilities
 import klaviyo_utils
+import waitlist_store
+import waitlist_wal
+import waitlist_stats
+import campaign_jobs
+import sent_ledger
+import rate_limit
 
 app = Flask(__name__)
 
 # GitHub configuration for waitlist storage
 GITHUB_TOKEN = os.getenv('GITHUB_TOKEN')
+GITHUB_API_URL = os.getenv('GITHUB_API_URL', 'https://api.github.com')
 REPO_OWNER = 'drinkitza'
 REPO_NAME = 'drinkitza'
 FILE_PATH = 'emails/waitlist.csv'
 
+# Storage layout on GitHub: 'single' rewrites FILE_PATH on every change, 'sharded'
+# spreads emails over hash buckets under SHARD_DIR (the first
+# GITHUB_SHARD_PREFIX_LENGTH hex digits of the email's sha1), so a signup or a
+# duplicate check touches one small bucket file. MANIFEST_PATH only lists the
+# files in use (at most 16 ** prefix length buckets, plus the legacy file).
+GITHUB_STORAGE_LAYOUT = os.getenv('GITHUB_STORAGE_LAYOUT', 'single')
+GITHUB_SHARD_PREFIX_LENGTH = int(os.getenv('GITHUB_SHARD_PREFIX_LENGTH', '2'))
+SHARD_DIR = 'emails/waitlist'
+MANIFEST_PATH = f'{SHARD_DIR}/manifest.json'
+_known_shards = set()
+_manifest_cache = {'sha': None, 'manifest': None}  # Last parsed manifest
+GITHUB_MISSING_TTL = float(os.getenv('GITHUB_MISSING_TTL', '30'))  # Seconds a 404 is trusted before asking again
+
+# In-process cache of GitHub files (content + sha) by path, keyed by ETag.
+# After one of our own PUTs the etag is unknown: the content we wrote is served
+# without a request for GITHUB_OWN_WRITE_TTL seconds (a write from someone else
+# in that window fails the next PUT's sha check, which re-reads and retries),
+# then one full GET learns the etag again.
+GITHUB_OWN_WRITE_TTL = float(os.getenv('GITHUB_OWN_WRITE_TTL', '30'))
+_github_file_cache = {}
+_github_file_lock = threading.Lock()
+
+# Group-commit mode: buffer accepted signups and write them to GitHub in one
+# commit every GITHUB_FLUSH_INTERVAL seconds or GITHUB_FLUSH_SIZE emails. The
+# buffer is an fsync'd log (see waitlist_wal), so rows accepted before a crash
+# are flushed by the next process instead of missing from GitHub.
+GITHUB_GROUP_COMMIT = os.getenv('GITHUB_GROUP_COMMIT', 'false').lower() == 'true'
+GITHUB_FLUSH_INTERVAL = float(os.getenv('GITHUB_FLUSH_INTERVAL', '5'))
+GITHUB_FLUSH_SIZE = int(os.getenv('GITHUB_FLUSH_SIZE', '50'))
+GITHUB_FLUSH_RETRIES = int(os.getenv('GITHUB_FLUSH_RETRIES', '5'))
+GITHUB_PENDING_PATH = os.getenv('GITHUB_PENDING_PATH',
+                                os.path.join(os.path.dirname(waitlist_wal.WAL_PATH), 'github_pending.wal'))
+_pending_github_count = 0  # Rows buffered by this process since its last flush
+_pending_github_cond = threading.Condition()
+_github_flush_lock = threading.Lock()  # One flush at a time (flusher thread, atexit, benchmark)
+_github_flusher = None
+
+# Fire-and-forget confirmation emails: acknowledge the signup once it's stored and
+# send the confirmation from a bounded worker pool (disk queue when saturated)
+ASYNC_CONFIRMATION_EMAILS = os.getenv('ASYNC_CONFIRMATION_EMAILS', 'false').lower() == 'true'
+CONFIRMATION_WORKERS = int(os.getenv('CONFIRMATION_WORKERS', '4'))
+CONFIRMATION_QUEUE_SIZE = int(os.getenv('CONFIRMATION_QUEUE_SIZE', '100'))
+_confirmation_pool = None
+_confirmation_pool_lock = threading.Lock()
+_confirmation_slots = threading.BoundedSemaphore(CONFIRMATION_QUEUE_SIZE)
+
+# Surge mode: /api/waitlist only validates, dedups locally and appends to the
+# fsync'd write-ahead log, returning 202. process_waitlist_wal.py replays the log
+# into GitHub and Klaviyo. Turned on by SURGE_MODE or once SURGE_QUEUE_DEPTH
+# signups are in flight (0 disables the automatic trigger).
+SURGE_MODE = os.getenv('SURGE_MODE', 'false').lower() == 'true'
+SURGE_QUEUE_DEPTH = int(os.getenv('SURGE_QUEUE_DEPTH', '0'))
+_inflight_signups = 0
+_surge_lock = threading.Lock()
+_surge_pending = None  # Normalized emails in the WAL that haven't been replayed yet
+_surge_pending_stamp = None  # Stamp of the WAL offset file when _surge_pending was loaded
+
+# Idempotency-Key support for /api/waitlist: a short-TTL, size-bounded cache of
+# responses so a resubmitted key gets the original answer without redoing any work
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', '600'))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv('IDEMPOTENCY_MAX_KEYS', '10000'))
+_idempotency_cache = OrderedDict()  # key -> {'expires', 'fingerprint', 'done' event, 'response' (body, status, headers)}
+# Statuses that depend on transient state (rate limits, conflicts), so a retry with the same key reruns
+IDEMPOTENCY_UNCACHED_STATUSES = (408, 409, 423, 425, 429)
+_idempotency_lock = threading.Lock()
+
+# Token-bucket admission control for /api/waitlist, keyed by client IP and by
+# normalized email. RATE_LIMIT_BACKEND=sqlite shares the buckets between workers.
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_IP_BURST = float(os.getenv('RATE_LIMIT_IP_BURST', '20'))
+RATE_LIMIT_IP_REFILL = float(os.getenv('RATE_LIMIT_IP_REFILL', '0.5'))  # Tokens per second
+RATE_LIMIT_EMAIL_BURST = float(os.getenv('RATE_LIMIT_EMAIL_BURST', '3'))
+RATE_LIMIT_EMAIL_REFILL = float(os.getenv('RATE_LIMIT_EMAIL_REFILL', '0.05'))
+# Number of proxies in front of the app whose X-Forwarded-For hop is trusted (1 on
+# Vercel or behind one nginx). With 0 the header is ignored, since clients control it.
+TRUSTED_PROXY_COUNT = int(os.getenv('TRUSTED_PROXY_COUNT', '0'))
+if TRUSTED_PROXY_COUNT:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT)
+_rate_limit_backend = rate_limit.create_backend() if RATE_LIMIT_ENABLED else None
+ip_limiter = rate_limit.TokenBucketLimiter('ip', RATE_LIMIT_IP_BURST, RATE_LIMIT_IP_REFILL, _rate_limit_backend)
+email_limiter = rate_limit.TokenBucketLimiter('email', RATE_LIMIT_EMAIL_BURST, RATE_LIMIT_EMAIL_REFILL, _rate_limit_backend)
+
+# Normalized emails in the GitHub copy of the waitlist as last read or written, by
+# file path. Duplicate checks also ask the local store, whose index is reloaded
+# when its files change (WAL drainer, other workers), so nothing here goes stale
+_github_emails = {}
+_email_index_lock = threading.Lock()
+email_index_stats = {'hits': 0, 'misses': 0}
+
+# Change feed for the admin dashboard: signups, removals and campaign progress in
+# this worker, numbered so pollers and event streams can resume after a cursor
+CHANGE_LOG_SIZE = int(os.getenv('CHANGE_LOG_SIZE', '10000'))
+CHANGE_FEED_MAX = int(os.getenv('CHANGE_FEED_MAX', '500'))
+SSE_HEARTBEAT_INTERVAL = float(os.getenv('SSE_HEARTBEAT_INTERVAL', '15'))
+SSE_RETRY_MS = int(os.getenv('SSE_RETRY_MS', '3000'))
+_change_log = deque(maxlen=CHANGE_LOG_SIZE)  # (seq, kind, data)
+_change_cond = threading.Condition()
+_change_seq = 0
+_change_reset_seq = 0  # Cursors before this sequence number have to reload
+_change_epoch = format(int(time.time() * 1000), 'x')  # Cursors from other processes/restarts reload
+_change_stamp = None  # Store stamp after the last write recorded in the log
+
+# Waitlist aggregates for /api/admin/stats, built from the store on first use and
+# then updated by record_change (rebuilt if the store is written outside this worker)
+_waitlist_stats = None
+
+# Bulk campaigns (admin_send_* without an email) run as background jobs
+# Workers default to on only where the job database can be written (not on read-only deploys like Vercel)
+CAMPAIGN_WORKERS_ENABLED = os.getenv(
+    'CAMPAIGN_WORKERS_ENABLED',
+    'true' if os.access(os.path.dirname(os.path.abspath(campaign_jobs.CAMPAIGN_DB_PATH)), os.W_OK) else 'false'
+).lower() == 'true'
+CAMPAIGN_WORKERS = int(os.getenv('CAMPAIGN_WORKERS', '1'))
+CAMPAIGN_PROGRESS_EVERY = int(os.getenv('CAMPAIGN_PROGRESS_EVERY', '10'))
+_campaign_engine = None
+_campaign_engine_lock = threading.Lock()
+# Template of each campaign; it is part of the sent-ledger key, so switching templates sends again
+CAMPAIGN_TEMPLATE_ENV = {
+    'educational': 'KLAVIYO_EDUCATIONAL_TEMPLATE_ID',
+    'brewing_guide': 'KLAVIYO_BREWING_GUIDE_TEMPLATE_ID',
+    'milestone': 'KLAVIYO_MILESTONE_TEMPLATE_ID',
+    'update': 'KLAVIYO_UPDATE_TEMPLATE_ID',
+}
+SENT_LEDGER_MAX_QUERY = int(os.getenv('SENT_LEDGER_MAX_QUERY', '1000'))
+
 # Simple admin authentication (for demo purposes only - use proper auth in production)
 ADMIN_USERNAME = os.getenv('ADMIN_USERNAME', 'admin')
 ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD', 'billions')
 
+# Admin email list paging (/api/admin/emails)
+ADMIN_PAGE_SIZE = int(os.getenv('ADMIN_PAGE_SIZE', '50'))
+ADMIN_MAX_PAGE_SIZE = int(os.getenv('ADMIN_MAX_PAGE_SIZE', '500'))
+ADMIN_QUERY_PARAMS = ('cursor', 'limit', 'q', 'domain', 'from', 'to', 'sort')
+BULK_REMOVE_MAX = int(os.getenv('BULK_REMOVE_MAX', '10000'))
+
+# Serialized admin GET responses per URL, valid while the store stamp is unchanged
+ADMIN_RESPONSE_CACHE_SIZE = int(os.getenv('ADMIN_RESPONSE_CACHE_SIZE', '256'))
+_admin_response_cache = OrderedDict()  # full path -> (etag, body)
+_admin_response_lock = threading.Lock()
+admin_response_stats = {'hits': 0, 'misses': 0}
+
 def log_error(e, context=""):
     """Log errors with context for easier debugging"""
     error_msg = f"""
@@ -45,11 +197,62 @@ def send_confirmation_email(recipient_email, next_drop=False):
         log_error(e, "send_confirmation_email")
         return False
 
+def _send_confirmation_in_background(recipient_email, next_drop):
+    """Worker pool task for dispatch_confirmation_email"""
+    try:
+        send_confirmation_email(recipient_email, next_drop)
+    finally:
+        _confirmation_slots.release()
+
+def dispatch_confirmation_email(recipient_email, next_drop=False):
+    """Hand the confirmation email to the worker pool without waiting on Klaviyo
+    
+    If CONFIRMATION_QUEUE_SIZE emails are already in flight the email goes to
+    the emails/queue directory for process_email_queue instead.
+    
+    Returns:
+        bool: True if the email was handed off (to the pool or the disk queue)
+    """
+    global _confirmation_pool
+    if _confirmation_slots.acquire(blocking=False):
+        with _confirmation_pool_lock:
+            if _confirmation_pool is None:
+                _confirmation_pool = ThreadPoolExecutor(max_workers=CONFIRMATION_WORKERS,
+                                                        thread_name_prefix='confirmation')
+        try:
+            _confirmation_pool.submit(_send_confirmation_in_background, recipient_email, next_drop)
+            return True
+        except Exception as e:
+            _confirmation_slots.release()
+            log_error(e, "dispatch_confirmation_email")
+    
+    print(f"Confirmation pool saturated, queueing email for {recipient_email}")
+    queued, _ = klaviyo_utils.queue_waitlist_confirmation_email(recipient_email, next_drop)
+    return queued
+
+def campaign_ledger_key(campaign):
+    """Sent-ledger key of a campaign with its current template"""
+    return sent_ledger.campaign_key(campaign, os.getenv(CAMPAIGN_TEMPLATE_ENV[campaign], ''))
+
+def record_sent(campaign, recipient_email, success, message):
+    """Record a campaign send in the sent ledger; emails queued for retry count as delivered"""
+    if success:
+        status = 'sent'
+    elif 'queued' in str(message).lower():
+        status = 'queued'
+    else:
+        status = 'failed'
+    try:
+        sent_ledger.get_ledger().record(campaign_ledger_key(campaign), recipient_email, status)
+    except Exception as e:
+        log_error(e, f"record_sent - {campaign} to {recipient_email}")
+
 def send_educational_email(recipient_email):
     """Send the educational email about yerba mate history and benefits"""
     try:
         success, message = klaviyo_utils.send_educational_email(recipient_email)
         print(f"Klaviyo educational email result: {success}, {message}")
+        record_sent('educational', recipient_email, success, message)
         return success
     except Exception as e:
         log_error(e, "send_educational_email")
@@ -60,6 +263,7 @@ def send_brewing_guide(recipient_email):
     try:
         success, message = klaviyo_utils.send_brewing_guide_email(recipient_email)
         print(f"Klaviyo brewing guide email result: {success}, {message}")
+        record_sent('brewing_guide', recipient_email, success, message)
         return success
     except Exception as e:
         log_error(e, "send_brewing_guide")
@@ -70,6 +274,7 @@ def send_milestone_email(recipient_email):
     try:
         success, message = klaviyo_utils.send_milestone_email(recipient_email)
         print(f"Klaviyo milestone email result: {success}, {message}")
+        record_sent('milestone', recipient_email, success, message)
         return success
     except Exception as e:
         log_error(e, "send_milestone_email")
@@ -80,40 +285,442 @@ def send_update_email(recipient_email):
     try:
         success, message = klaviyo_utils.send_update_email(recipient_email)
         print(f"Klaviyo update email result: {success}, {message}")
+        record_sent('update', recipient_email, success, message)
         return success
     except Exception as e:
         log_error(e, "send_update_email")
         return False
 
-def check_duplicate_email(email):
-    """Check if email already exists in the waitlist"""
-    url = f'https://api.github.com/repos/{REPO_OWNER}/{REPO_NAME}/contents/{FILE_PATH}'
-    headers = {
+def normalize_email(email):
+    """Normalize an email address for duplicate checks"""
+    return email.strip().lower()
+
+def parse_emails(content):
+    """Get the set of normalized emails in a waitlist CSV string"""
+    emails = set()
+    for line in content.splitlines():
+        email = line.split(',')[0]
+        if '@' in email:
+            emails.add(normalize_email(email))
+    return emails
+
+def get_email_index():
+    """Get every known normalized email (local store plus GitHub files), for stats"""
+    index = {normalize_email(email) for email in waitlist_store.get_store().emails()}
+    with _email_index_lock:
+        for emails in _github_emails.values():
+            index |= emails
+    return index
+
+def remember_github_emails(path, content):
+    """Replace the emails known from a GitHub file with those in its latest content"""
+    if path == MANIFEST_PATH:
+        return
+    emails = parse_emails(content)
+    with _email_index_lock:
+        _github_emails[path] = emails
+
+def remove_from_email_index(email):
+    """Forget a removed email in the GitHub files as last read, until they are read again"""
+    email = normalize_email(email)
+    with _email_index_lock:
+        for emails in _github_emails.values():
+            emails.discard(email)
+
+def email_in_index(email):
+    """Check whether an email is on the waitlist: in the local store or the GitHub files as last read"""
+    email = normalize_email(email)
+    try:
+        found = waitlist_store.get_store().contains(email)
+    except Exception as e:
+        log_error(e, "email_in_index - reading the local store")
+        found = False
+    with _email_index_lock:
+        if not found:
+            found = any(email in emails for emails in _github_emails.values())
+        email_index_stats['hits' if found else 'misses'] += 1
+    return found
+
+def github_headers():
+    """Headers for the GitHub contents API"""
+    return {
         'Authorization': f'token {GITHUB_TOKEN}',
         'Accept': 'application/vnd.github.v3+json'
     }
+
+def github_file_url(path=FILE_PATH):
+    """Contents API URL for a file in the repository"""
+    return f'{GITHUB_API_URL}/repos/{REPO_OWNER}/{REPO_NAME}/contents/{path}'
+
+def invalidate_github_cache(path=FILE_PATH):
+    """Forget a cached GitHub file so the next read does a full GET"""
+    with _github_file_lock:
+        _github_file_cache.pop(path, None)
+
+def get_github_file(path=FILE_PATH):
+    """Get a file from GitHub as (content, sha), revalidating the cache with If-None-Match
     
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        current_file = response.json()
+    A file that doesn't exist yet is returned as ('', None).
+    """
+    with _github_file_lock:
+        cached = dict(_github_file_cache.get(path) or {'etag': None, 'sha': None, 'content': None})
+    if cached.get('missing_until', 0) > time.time():
+        return '', None
+    if cached.get('written_until', 0) > time.time():
+        return cached['content'], cached['sha']
+    
+    headers = github_headers()
+    if cached['etag']:
+        headers['If-None-Match'] = cached['etag']
+    
+    url = github_file_url(path)
+    response = requests.get(url, headers=headers)
+    if response.status_code == 304:
+        return cached['content'], cached['sha']
+    if response.status_code == 404:
+        # Trusted only briefly, the file may be created by another writer
+        with _github_file_lock:
+            _github_file_cache[path] = {'etag': None, 'sha': None, 'content': None,
+                                        'missing_until': time.time() + GITHUB_MISSING_TTL}
+        return '', None
+    response.raise_for_status()
+    current_file = response.json()
+    sha = current_file.get('sha')
+    
+    if cached['content'] is not None and sha == cached['sha']:
+        # Unchanged since our own last write, just learn its etag
+        with _github_file_lock:
+            _github_file_cache[path] = dict(cached, etag=response.headers.get('ETag'))
+        return cached['content'], sha
+    
+    if current_file.get('content'):
+        content = base64.b64decode(current_file['content']).decode('utf-8')
+    elif current_file.get('size'):
+        # Files over 1 MB come back without inline content, fetch the raw bytes instead
+        raw_headers = github_headers()
+        raw_headers['Accept'] = 'application/vnd.github.v3.raw'
+        raw_response = requests.get(url, headers=raw_headers)
+        raw_response.raise_for_status()
+        content = raw_response.content.decode('utf-8')
+    else:
+        content = ''
+    
+    with _github_file_lock:
+        _github_file_cache[path] = {
+            'etag': response.headers.get('ETag'),
+            'sha': sha,
+            'content': content
+        }
+    
+    # Only parsed when the file actually changed
+    remember_github_emails(path, content)
+    return content, sha
+
+def put_github_file(new_content, sha, message, path=FILE_PATH):
+    """Write a file to GitHub and refresh the cache from the PUT response"""
+    data = {
+        'message': message,
+        'content': base64.b64encode(new_content.encode('utf-8')).decode('utf-8')
+    }
+    if sha:
+        data['sha'] = sha
+    
+    response = requests.put(github_file_url(path), headers=github_headers(), json=data)
+    if response.status_code in (409, 422):
+        # Someone else changed the file since we read it
+        invalidate_github_cache(path)
+    response.raise_for_status()
+    
+    new_sha = (response.json().get('content') or {}).get('sha')
+    with _github_file_lock:
+        _github_file_cache[path] = {'etag': None, 'sha': new_sha, 'content': new_content,
+                                    'written_until': time.time() + GITHUB_OWN_WRITE_TTL}
+    remember_github_emails(path, new_content)
+    return response
+
+def is_github_conflict(e):
+    """Check whether an exception is GitHub rejecting a write because of a stale sha"""
+    response = getattr(e, 'response', None)
+    return response is not None and response.status_code in (409, 422)
+
+def get_shard_manifest(fresh=False):
+    """Get the shard manifest from GitHub as (manifest dict, sha)
+    
+    Before any bucket exists the legacy single file is the only shard. The
+    parsed manifest is shared between calls unless fresh is set, so only
+    callers that modify it should ask for a fresh copy.
+    """
+    content, sha = get_github_file(MANIFEST_PATH)
+    if not content:
+        return {'layout': 'hashed', 'prefix_length': GITHUB_SHARD_PREFIX_LENGTH, 'shards': [FILE_PATH]}, sha
+    if not fresh and _manifest_cache['sha'] == sha and sha is not None:
+        return _manifest_cache['manifest'], sha
+    
+    manifest = json.loads(content)
+    manifest.setdefault('prefix_length', GITHUB_SHARD_PREFIX_LENGTH)
+    if not fresh:
+        _manifest_cache.update(sha=sha, manifest=manifest)
+    return manifest, sha
+
+def shard_path_for(email, manifest):
+    """Hash bucket file an email belongs in"""
+    digest = hashlib.sha1(normalize_email(email).encode('utf-8')).hexdigest()
+    return f"{SHARD_DIR}/{digest[:manifest['prefix_length']]}.csv"
+
+def is_bucket_path(path, manifest):
+    """Whether a manifest entry is a hash bucket (not the legacy file or an older layout's shard)"""
+    name = path[len(SHARD_DIR) + 1:-len('.csv')] if path.startswith(SHARD_DIR + '/') else ''
+    return len(name) == manifest['prefix_length'] and all(c in '0123456789abcdef' for c in name)
+
+def register_shard(path):
+    """Add a bucket to the manifest if it isn't listed yet"""
+    if path in _known_shards:
+        return
+    
+    for attempt in range(GITHUB_FLUSH_RETRIES):
+        manifest, sha = get_shard_manifest(fresh=True)
+        if path in manifest['shards']:
+            break
+        manifest['shards'].append(path)
+        manifest['layout'] = 'hashed'
+        try:
+            put_github_file(json.dumps(manifest, indent=2) + '\n', sha, f'Add waitlist shard {path}', MANIFEST_PATH)
+            break
+        except requests.exceptions.HTTPError as e:
+            if is_github_conflict(e) and attempt < GITHUB_FLUSH_RETRIES - 1:
+                continue
+            raise
+    _known_shards.add(path)
+
+def shards_for(emails):
+    """Files that may hold any of the emails: their buckets plus any listed file that isn't a bucket"""
+    manifest, _ = get_shard_manifest()
+    paths = [shard_path_for(email, manifest) for email in emails]
+    paths.extend(path for path in manifest['shards'] if not is_bucket_path(path, manifest))
+    return list(dict.fromkeys(paths))
+
+def append_to_github(rows, message, retries=2):
+    """Append (email, timestamp) rows to the GitHub copy of the waitlist
+    
+    Each target file gets one commit. On a sha conflict the write is retried
+    against the fresh file, skipping rows another writer already added.
+    
+    Returns:
+        set: normalized emails that were skipped because they were already there
+    """
+    if GITHUB_STORAGE_LAYOUT == 'sharded':
+        manifest, _ = get_shard_manifest()
+        rows_by_path = {}
+        for email, timestamp in rows:
+            rows_by_path.setdefault(shard_path_for(email, manifest), []).append((email, timestamp))
+    else:
+        rows_by_path = {FILE_PATH: rows}
+    
+    skipped = set()
+    for path, path_rows in rows_by_path.items():
+        skipped |= append_rows_to_github_file(path, path_rows, message, retries)
+        if GITHUB_STORAGE_LAYOUT == 'sharded':
+            register_shard(path)
+    return skipped
+
+def append_rows_to_github_file(path, rows, message, retries=2):
+    """Append rows to one GitHub file in one commit, skipping emails already in it
+    
+    Returns:
+        set: normalized emails that were skipped
+    """
+    skipped = set()
+    for attempt in range(retries):
+        try:
+            content, sha = get_github_file(path)
+            existing = parse_emails(content)
+            skipped = {normalize_email(email) for email, _ in rows if normalize_email(email) in existing}
+            new_lines = ''.join(f'{email},{timestamp}\n' for email, timestamp in rows
+                                if normalize_email(email) not in existing)
+            if not new_lines:
+                break
+            
+            if not content:
+                content = 'email,timestamp\n'
+            elif not content.endswith('\n'):
+                content += '\n'
+            put_github_file(content + new_lines, sha, message, path)
+            break
+        except requests.exceptions.HTTPError as e:
+            if is_github_conflict(e) and attempt < retries - 1:
+                print(f"GitHub sha conflict while writing {path}, retrying")
+                time.sleep(0.2 * (attempt + 1))
+                continue
+            raise
+    return skipped
+
+def remove_from_github(emails, retries=2):
+    """Remove emails from the GitHub copy of the waitlist, one commit per file touched
+    
+    On a sha conflict the file is re-read and the removal retried.
+    
+    Returns:
+        set: normalized emails that were found and removed
+    """
+    to_remove = {normalize_email(email) for email in emails}
+    removed = set()
+    
+    if GITHUB_STORAGE_LAYOUT == 'sharded':
+        paths = shards_for(emails)
+    else:
+        paths = [FILE_PATH]
+    
+    for path in paths:
+        for attempt in range(retries):
+            current_content, sha = get_github_file(path)
+            
+            # Remove the email lines
+            kept_lines = []
+            found = set()
+            for line in current_content.splitlines():
+                line_email = normalize_email(line.split(',')[0])
+                if line_email in to_remove:
+                    found.add(line_email)
+                else:
+                    kept_lines.append(line + '\n')
+            
+            if not found:
+                break
+            
+            # Update the file on GitHub
+            if len(found) == 1:
+                message = f'Remove email {next(iter(found))} from waitlist'
+            else:
+                message = f'Remove {len(found)} emails from waitlist'
+            try:
+                put_github_file(''.join(kept_lines), sha, message, path)
+            except requests.exceptions.HTTPError as e:
+                if is_github_conflict(e) and attempt < retries - 1:
+                    print(f"GitHub sha conflict while removing from {path}, retrying")
+                    time.sleep(0.2 * (attempt + 1))
+                    continue
+                raise
+            removed |= found
+            break
         
-        if 'content' in current_file:
-            content = base64.b64decode(current_file['content']).decode('utf-8')
-            emails = [line.split(',')[0].lower() for line in content.splitlines() if line.strip()]
-            return email.lower() in emails, current_file.get('sha')
-        return False, current_file.get('sha')
+        if removed == to_remove:
+            break
+    
+    return removed
+
+def check_duplicate_email(email):
+    """Check if email already exists in the waitlist"""
+    sha = None
+    try:
+        # Revalidate the GitHub copy so the index picks up rows from other writers
+        if GITHUB_STORAGE_LAYOUT == 'sharded':
+            # Only the email's bucket (and the legacy file, which no longer changes)
+            for path in shards_for([email]):
+                content, sha = get_github_file(path)
+        else:
+            content, sha = get_github_file()
     except Exception as e:
         log_error(e, "check_duplicate_email")
-        return False, None
+    return email_in_index(email), sha
 
-def save_to_github(email):
-    """Save email to GitHub repository"""
-    url = f'https://api.github.com/repos/{REPO_OWNER}/{REPO_NAME}/contents/{FILE_PATH}'
-    headers = {
-        'Authorization': f'token {GITHUB_TOKEN}',
-        'Accept': 'application/vnd.github.v3+json'
-    }
+def flush_github_buffer():
+    """Write all buffered signups to GitHub in a single commit (per bucket in the sharded layout)
+    
+    Retries optimistically against the fresh file on sha conflicts. Rows that
+    still can't be written stay in the log for the next flush. Other workers
+    may flush the same log: the rows they already wrote are skipped.
+    
+    Returns:
+        int: number of rows written
+    """
+    global _pending_github_count
+    with _github_flush_lock:
+        with _pending_github_cond:
+            counted = _pending_github_count
+        # Rows are logged before they are counted, so everything counted is read here
+        entries = waitlist_wal.read_pending(GITHUB_PENDING_PATH)
+        if entries:
+            rows = [(entry['email'], entry['timestamp']) for _, entry in entries]
+            try:
+                append_to_github(rows, f'Add {len(rows)} emails to waitlist', retries=GITHUB_FLUSH_RETRIES)
+            except Exception as e:
+                log_error(e, "flush_github_buffer")
+                return 0
+            waitlist_wal.write_offset(max(entries[-1][0], waitlist_wal.read_offset(GITHUB_PENDING_PATH)),
+                                      GITHUB_PENDING_PATH)
+            waitlist_wal.truncate_if_drained(GITHUB_PENDING_PATH)
+            print(f"Flushed {len(rows)} emails to GitHub")
+        
+        with _pending_github_cond:
+            _pending_github_count -= counted
+        return len(entries)
+
+def _github_flush_loop():
+    """Background loop that flushes the signup buffer by size or age"""
+    while True:
+        with _pending_github_cond:
+            _pending_github_cond.wait_for(lambda: _pending_github_count)
+            _pending_github_cond.wait_for(
+                lambda: _pending_github_count >= GITHUB_FLUSH_SIZE,
+                timeout=GITHUB_FLUSH_INTERVAL
+            )
+        if flush_github_buffer() == 0:
+            # GitHub is failing, don't spin on the same rows
+            time.sleep(GITHUB_FLUSH_INTERVAL)
+
+def start_github_flusher(count=0):
+    """Count newly buffered rows and start the flusher if needed"""
+    global _github_flusher, _pending_github_count
+    with _pending_github_cond:
+        _pending_github_count += count
+        _pending_github_cond.notify_all()
+        if _github_flusher is None:
+            _github_flusher = threading.Thread(target=_github_flush_loop, daemon=True)
+            _github_flusher.start()
+
+def buffer_github_write(email, timestamp):
+    """Log a signup for the next group commit, starting the flusher if needed"""
+    waitlist_wal.append({'email': email, 'timestamp': timestamp}, GITHUB_PENDING_PATH)
+    start_github_flusher(1)
+
+def recover_github_buffer():
+    """Flush rows a previous process logged but didn't write to GitHub before it stopped"""
+    try:
+        pending = waitlist_wal.pending_count(GITHUB_PENDING_PATH)
+    except Exception as e:
+        log_error(e, "recover_github_buffer")
+        return
+    if pending:
+        print(f"Found {pending} buffered signups not yet written to GitHub")
+        start_github_flusher(pending)
+
+@atexit.register
+def _flush_github_on_exit():
+    """Don't leave buffered signups for the next process on a clean shutdown"""
+    if _pending_github_count:
+        flush_github_buffer()
+
+if GITHUB_GROUP_COMMIT:
+    recover_github_buffer()
+
+def save_to_github(email, timestamp=None):
+    """Save email to GitHub repository (timestamp defaults to now)"""
+    if timestamp is None:
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    
+    if GITHUB_GROUP_COMMIT:
+        is_duplicate, _ = check_duplicate_email(email)
+        if is_duplicate:
+            return 'duplicate'
+        
+        # Saved locally right away, written to GitHub by the next group commit
+        save_to_local_csv(email, timestamp)
+        try:
+            buffer_github_write(email, timestamp)
+        except Exception as e:
+            log_error(e, "save_to_github - buffering for the group commit")
+            return 'error'
+        return 'success'
     
     try:
         # Check for duplicates
@@ -121,30 +728,11 @@ def save_to_github(email):
         if is_duplicate:
             return 'duplicate'
         
-        # Get current content
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        current_file = response.json()
-        
-        # Add new email
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        new_email_line = f'{email},{timestamp}\n'
-        
-        if 'content' in current_file:
-            content = base64.b64decode(current_file['content']).decode('utf-8')
-            new_content = content + new_email_line
-        else:
-            new_content = new_email_line
-        
-        # Update file
-        data = {
-            'message': f'Add email: {email}',
-            'content': base64.b64encode(new_content.encode('utf-8')).decode('utf-8'),
-            'sha': sha
-        }
-        
-        update_response = requests.put(url, headers=headers, json=data)
-        update_response.raise_for_status()
+        # Add new email, retrying once against the fresh file if our cached sha is stale
+        skipped = append_to_github([(email, timestamp)], f'Add email: {email}')
+        if skipped:
+            # Another writer added it after our duplicate check
+            return 'duplicate'
         
         # Also save to local CSV for backup
         save_to_local_csv(email, timestamp)
@@ -153,98 +741,377 @@ def save_to_github(email):
     except Exception as e:
         error_msg = log_error(e, "save_to_github")
         # Try to save locally as fallback
-        save_to_local_csv(email)
+        save_to_local_csv(email, timestamp)
         return 'error'
 
 def save_to_local_csv(email, timestamp=None):
-    """Save email to local CSV file as backup"""
+    """Save email to the local waitlist store as backup"""
     try:
         if timestamp is None:
             timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            
-        csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'emails', 'waitlist.csv')
-        os.makedirs(os.path.dirname(csv_path), exist_ok=True)
         
-        with open(csv_path, 'a', encoding='utf-8') as f:
-            f.write(f'{email},{timestamp}\n')
+        with _change_cond:
+            waitlist_store.get_store().add(email, timestamp)
+            record_change('added', email, timestamp)
         return True
     except Exception as e:
         log_error(e, "save_to_local_csv")
         return False
 
 def get_all_emails_from_csv():
-    """Get all emails from the local CSV file"""
-    emails = []
-    csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'emails', 'waitlist.csv')
-    
-    if not os.path.exists(csv_path):
-        return emails
-    
+    """Get all emails from the local waitlist store"""
     try:
-        with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if 'email' in row and 'timestamp' in row:
-                    emails.append({
-                        'email': row['email'],
-                        'timestamp': row['timestamp']
-                    })
+        return waitlist_store.get_store().all()
     except Exception as e:
         log_error(e, "get_all_emails_from_csv")
-    
-    return emails
+        return []
 
 def remove_email_from_csv(email_to_remove):
-    """Remove an email from the local CSV file"""
-    csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'emails', 'waitlist.csv')
-    
-    print(f"Attempting to remove email: {email_to_remove}")
-    print(f"CSV path: {csv_path}")
+    """Remove an email from the local waitlist store"""
+    if not email_in_index(email_to_remove):
+        print(f"Email not in index, skipping removal: {email_to_remove}")
+        return False
     
-    if not os.path.exists(csv_path):
-        print(f"CSV file not found at: {csv_path}")
+    try:
+        with _change_cond:
+            removed = waitlist_store.get_store().remove(email_to_remove)
+            if removed:
+                record_change('removed', email_to_remove, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    except Exception as e:
+        error_msg = log_error(e, "remove_email_from_csv")
+        print(f"Error in remove_email_from_csv: {error_msg}")
         return False
     
-    temp_path = csv_path + '.temp'
-    removed = False
+    if removed:
+        remove_from_email_index(email_to_remove)
+    return removed
+
+def remove_emails_from_csv(emails):
+    """Remove several emails from the local waitlist store in one pass
     
+    Returns:
+        set: normalized emails that were removed
+    """
     try:
-        # Read all existing emails
-        all_emails = []
-        with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                print(f"Reading row: {row}")
-                all_emails.append(row)
-        
-        # Filter out the email to remove
-        filtered_emails = []
-        for email_data in all_emails:
-            if email_data['email'].lower() != email_to_remove.lower():
-                filtered_emails.append(email_data)
+        with _change_cond:
+            removed = waitlist_store.get_store().remove_many(emails)
+            removed_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            for email in sorted(removed):
+                record_change('removed', email, removed_at)
+    except Exception as e:
+        log_error(e, "remove_emails_from_csv")
+        return set()
+    
+    for email in removed:
+        remove_from_email_index(email)
+    return removed
+
+def record_change(kind, email, timestamp):
+    """Append a signup ('added') or removal ('removed') to the change feed
+
+    Callers hold _change_cond around the store write so the stamp taken here
+    covers exactly the writes in the log.
+    """
+    global _change_stamp
+    with _change_cond:
+        publish_event(kind, {'email': email, 'timestamp': timestamp})
+        _change_stamp = waitlist_store.get_store().stamp()
+        if _waitlist_stats is not None:
+            if kind == 'added':
+                _waitlist_stats.add(email, timestamp)
             else:
-                removed = True
-                print(f"Found and removing email: {email_to_remove}")
+                _waitlist_stats.remove(email)
+
+def publish_event(kind, data):
+    """Append an event to the change feed and wake up event streams"""
+    global _change_seq
+    with _change_cond:
+        _change_seq += 1
+        _change_log.append((_change_seq, kind, data))
+        _change_cond.notify_all()
+
+def publish_campaign_progress(job):
+    """Publish a campaign job's progress as a 'campaign' event"""
+    publish_event('campaign', job)
+
+def campaign_sender(campaign, send):
+    """Wrap a send_* function for campaign jobs
+    
+    Each recipient is claimed in the sent ledger first, so two jobs for the
+    same campaign (two admin clicks) can't both email them; resend skips the
+    claim. The Klaviyo calls are paced by klaviyo_utils.send_limiter.
+    """
+    def send_claimed(recipient_email, resend=False):
+        if not resend and not sent_ledger.get_ledger().claim(campaign_ledger_key(campaign), recipient_email):
+            print(f"Skipping {recipient_email}: {campaign} email already sent or being sent")
+            return campaign_jobs.SKIPPED
+        with klaviyo_utils.bulk_sending():
+            return send(recipient_email)
+    return send_claimed
+
+def get_campaign_engine():
+    """Get the campaign job engine, creating it (and its database) on first use
+    
+    Only the campaign routes call this, so a database that can't be created
+    doesn't break the rest of the app. Starts the workers if enabled, which
+    resumes unfinished jobs.
+    
+    Returns:
+        campaign_jobs.CampaignEngine: The engine, or None if it couldn't be created
+    """
+    global _campaign_engine
+    with _campaign_engine_lock:
+        if _campaign_engine is None:
+            try:
+                _campaign_engine = campaign_jobs.CampaignEngine(
+                    {
+                        'educational': campaign_sender('educational', send_educational_email),
+                        'brewing_guide': campaign_sender('brewing_guide', send_brewing_guide),
+                        'milestone': campaign_sender('milestone', send_milestone_email),
+                        'update': campaign_sender('update', send_update_email),
+                    },
+                    workers=CAMPAIGN_WORKERS,
+                    on_progress=publish_campaign_progress,
+                    progress_every=CAMPAIGN_PROGRESS_EVERY
+                )
+            except Exception as e:
+                log_error(e, f"get_campaign_engine - opening {campaign_jobs.CAMPAIGN_DB_PATH}")
+                return None
+        if CAMPAIGN_WORKERS_ENABLED:
+            _campaign_engine.start()
+        return _campaign_engine
+
+def campaign_engine_unavailable():
+    """Response for campaign routes when the job database can't be opened"""
+    return jsonify({'error': 'Campaign jobs are unavailable: the job database could not be opened'}), 503
+
+def sync_change_stamp():
+    """Invalidate the change feed if the store was written outside this worker
+
+    Rows drained from the WAL, compactions and other workers don't go through
+    record_change, so pollers are told to reload instead of missing them.
+    """
+    global _change_seq, _change_reset_seq, _change_stamp, _waitlist_stats
+    with _change_cond:
+        stamp = waitlist_store.get_store().stamp()
+        if stamp == _change_stamp:
+            return
+        if _change_stamp is not None:
+            _change_seq += 1
+            _change_reset_seq = _change_seq
+            _change_log.clear()
+            _waitlist_stats = None
+            _change_cond.notify_all()
+        _change_stamp = stamp
+
+def get_waitlist_stats():
+    """Get the waitlist aggregates, building them from the store on first use"""
+    global _waitlist_stats
+    with _change_cond:
+        # Take the stamp first so writes from outside this worker after the load are noticed
+        sync_change_stamp()
+        if _waitlist_stats is None:
+            _waitlist_stats = waitlist_stats.WaitlistStats(get_all_emails_from_csv())
+            print(f"Loaded waitlist stats with {len(_waitlist_stats.signups)} emails")
+        return _waitlist_stats
+
+def read_events(cursor, limit=CHANGE_FEED_MAX):
+    """Get the events after a change-feed cursor
+
+    Args:
+        cursor: Cursor from a previous call ('<epoch>:<seq>'), or None
+        limit: Maximum events to return
+
+    Returns:
+        tuple: (reset, [(seq, kind, data)], new cursor) where reset means the cursor
+        is missing, too old or from another worker and the caller has to reload
+    """
+    with _change_cond:
+        sync_change_stamp()
+        after = None
+        if cursor:
+            epoch, _, seq = cursor.partition(':')
+            if epoch == _change_epoch and seq.isdigit():
+                after = int(seq)
+
+        oldest = _change_log[0][0] if _change_log else _change_seq + 1
+        if after is None or after < _change_reset_seq or after > _change_seq or oldest > after + 1:
+            return True, [], f'{_change_epoch}:{_change_seq}'
+
+        start = after + 1 - oldest
+        entries = [_change_log[i] for i in range(start, min(len(_change_log), start + limit))]
+
+    last_seq = entries[-1][0] if entries else after
+    return False, entries, f'{_change_epoch}:{last_seq}'
+
+def get_changes(cursor):
+    """Get the signups and removals made after a change-feed cursor
+
+    Returns:
+        dict: {'cursor', 'reset', 'changes', 'more'}
+    """
+    reset, entries, new_cursor = read_events(cursor)
+    changes = [{'type': kind, 'email': data['email'], 'timestamp': data['timestamp']}
+               for _, kind, data in entries if kind in ('added', 'removed')]
+    return {
+        'cursor': new_cursor,
+        'reset': reset,
+        'changes': changes,
+        'more': not reset and int(new_cursor.rpartition(':')[2]) < _change_seq
+    }
+
+def format_sse(event, data, event_id=None):
+    """Format one Server-Sent Events message"""
+    message = ''
+    if event_id:
+        message += f'id: {event_id}\n'
+    message += f'event: {event}\ndata: {json.dumps(data)}\n\n'
+    return message
+
+def stream_events(cursor):
+    """Yield change-feed events as Server-Sent Events, resuming after cursor
+
+    Sends a comment line every SSE_HEARTBEAT_INTERVAL seconds so proxies keep
+    the connection open, and a 'reset' event when the client has to reload.
+    """
+    yield f'retry: {SSE_RETRY_MS}\n\n'
+    while True:
+        reset, entries, cursor = read_events(cursor)
+        if reset:
+            yield format_sse('reset', {}, cursor)
+            continue
+
+        for seq, kind, data in entries:
+            yield format_sse(kind, data, f'{_change_epoch}:{seq}')
+
+        if not entries:
+            with _change_cond:
+                woken = True
+                if int(cursor.rpartition(':')[2]) >= _change_seq:
+                    woken = _change_cond.wait(timeout=SSE_HEARTBEAT_INTERVAL)
+            if not woken:
+                yield ': heartbeat\n\n'
+
+def surge_mode_active():
+    """Whether signups should take the ingest-only path"""
+    return SURGE_MODE or (SURGE_QUEUE_DEPTH > 0 and _inflight_signups >= SURGE_QUEUE_DEPTH)
+
+def get_surge_pending():
+    """Get the set of emails waiting in the WAL (call with _surge_lock held)
+    
+    Reloaded whenever the drainer has moved its offset, so replayed emails
+    (which may since have been removed by an admin) drop out of it.
+    """
+    global _surge_pending, _surge_pending_stamp
+    stamp = waitlist_store.file_stamp(waitlist_wal.offset_path())
+    if _surge_pending is None or stamp != _surge_pending_stamp:
+        _surge_pending = {normalize_email(entry['email']) for _, entry in waitlist_wal.read_pending()}
+        _surge_pending_stamp = stamp
+    return _surge_pending
+
+def ingest_signup(email, next_drop):
+    """Durably log a signup for the WAL drainer and acknowledge it with a 202"""
+    with _surge_lock:
+        pending = get_surge_pending()
+        if normalize_email(email) in pending:
+            return jsonify({
+                'status': 'already_registered',
+                'message': "You're already on our waitlist!"
+            })
         
-        # Write back the filtered emails
-        with open(temp_path, 'w', encoding='utf-8', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=['email', 'timestamp'])
-            writer.writeheader()
-            for email_data in filtered_emails:
-                writer.writerow(email_data)
+        waitlist_wal.append({
+            'email': email,
+            'next_drop': next_drop,
+            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        })
+        pending.add(normalize_email(email))
+    
+    return jsonify({
+        'status': 'accepted',
+        'email_status': 'queued',
+        'message': "You're on the waitlist! Check your email for confirmation."
+    }), 202
+
+def track_inflight_signups(delta):
+    """Adjust the count of signups currently going through GitHub and Klaviyo"""
+    global _inflight_signups
+    with _surge_lock:
+        _inflight_signups += delta
+
+def request_fingerprint():
+    """Hash of the normalized request body, stored with an Idempotency-Key"""
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = dict(data)
+        if isinstance(data.get('email'), str):
+            data['email'] = normalize_email(data['email'])
+        body = json.dumps(data, sort_keys=True).encode('utf-8')
+    else:
+        body = request.get_data()
+    return hashlib.sha256(body).hexdigest()
+
+def claim_idempotency_key(key, fingerprint):
+    """Get the cache entry for an Idempotency-Key
+    
+    Args:
+        key: The Idempotency-Key header value
+        fingerprint: request_fingerprint() of this request, compared with the first one's
+    
+    Returns:
+        tuple: (entry dict, True if the caller is the first request for the key)
+    """
+    now = time.time()
+    with _idempotency_lock:
+        # Entries are kept in insertion order, so expired ones are at the front
+        while _idempotency_cache:
+            oldest = next(iter(_idempotency_cache.values()))
+            if oldest['expires'] > now and len(_idempotency_cache) < IDEMPOTENCY_MAX_KEYS:
+                break
+            _idempotency_cache.popitem(last=False)
         
-        if removed:
-            print(f"Email found and removed, replacing {temp_path} with {csv_path}")
-            os.replace(temp_path, csv_path)
-        else:
-            print(f"Email not found, removing temp file: {temp_path}")
-            os.remove(temp_path)
+        entry = _idempotency_cache.get(key)
+        if entry is not None:
+            return entry, False
+        
+        entry = {'expires': now + IDEMPOTENCY_TTL, 'fingerprint': fingerprint,
+                 'done': threading.Event(), 'response': None}
+        _idempotency_cache[key] = entry
+        return entry, True
+
+def release_idempotency_key(key, entry, response):
+    """Store the response for an Idempotency-Key, or forget the key if the request failed or was transient"""
+    if (response is not None and response.status_code < 500
+            and response.status_code not in IDEMPOTENCY_UNCACHED_STATUSES):
+        entry['response'] = (response.get_data(), response.status_code, list(response.headers.items()))
+    else:
+        with _idempotency_lock:
+            if _idempotency_cache.get(key) is entry:
+                del _idempotency_cache[key]
+    entry['done'].set()
+
+def get_client_ip():
+    """Client IP of the current request (ProxyFix resolves it from the trusted proxies' X-Forwarded-For)"""
+    return request.remote_addr or 'unknown'
+
+def check_rate_limit(limiter, key):
+    """Return a 429 response if the limiter rejects key, otherwise None"""
+    if not RATE_LIMIT_ENABLED:
+        return None
+    
+    try:
+        allowed, retry_after = limiter.allow(key)
     except Exception as e:
-        error_msg = log_error(e, "remove_email_from_csv")
-        print(f"Error in remove_email_from_csv: {error_msg}")
-        return False
+        # Never turn signups away because the limiter itself is broken
+        log_error(e, "check_rate_limit")
+        return None
     
-    return removed
+    if allowed:
+        return None
+    
+    response = jsonify({'error': 'Too many requests, please try again shortly'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+    return response
 
 # Routes
 @app.route('/')
@@ -268,12 +1135,226 @@ def static_files(path):
     return send_from_directory('static', path)
 
 # Admin API endpoints
+def cached_json_response(build, version=''):
+    """Serve a GET response from a per-version cache with a strong ETag
+
+    The version is the waitlist store's stamp (file sizes and mtimes), so a
+    request whose If-None-Match matches gets a 304 without touching the data,
+    and repeated requests for the same URL and version reuse the serialized
+    body. build() makes the response on a miss; only 200s are cached. version
+    is mixed into the ETag for responses that also depend on something else,
+    like the current hour.
+    """
+    stamp = waitlist_store.get_store().stamp()
+    key = request.full_path
+    etag = hashlib.sha1(f'{key}|{stamp}|{version}'.encode('utf-8')).hexdigest()[:24]
+
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        with _admin_response_lock:
+            cached = _admin_response_cache.get(key)
+            if cached and cached[0] == etag:
+                _admin_response_cache.move_to_end(key)
+                admin_response_stats['hits'] += 1
+                body = cached[1]
+            else:
+                body = None
+                admin_response_stats['misses'] += 1
+
+        if body is None:
+            response = make_response(build())
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            with _admin_response_lock:
+                _admin_response_cache[key] = (etag, body)
+                _admin_response_cache.move_to_end(key)
+                while len(_admin_response_cache) > ADMIN_RESPONSE_CACHE_SIZE:
+                    _admin_response_cache.popitem(last=False)
+        response = app.response_class(body, status=200, mimetype='application/json')
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'  # Always revalidate
+    return response
+
+def encode_cursor(row):
+    """Opaque pagination cursor for the (timestamp, id) key of a row"""
+    key = json.dumps([row['timestamp'], row['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Decode a pagination cursor back into a (timestamp, id) key
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    if not cursor:
+        return None
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not isinstance(timestamp, str) or not isinstance(row_id, int):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return timestamp, row_id
+
 @app.route('/api/admin/emails', methods=['GET'])
 def admin_get_emails():
-    """Get all emails in the waitlist"""
+    """Get emails in the waitlist, revalidated with ETags"""
     # Authentication is now handled on the frontend
-    emails = get_all_emails_from_csv()
-    return jsonify({'emails': emails})
+    return cached_json_response(build_admin_emails_response)
+
+def build_admin_emails_response():
+    """Build the /api/admin/emails response
+
+    Without query parameters returns the whole list. With any of cursor, limit,
+    q, domain, from, to or sort returns one page plus the cursor of the next
+    page and the number of matching rows.
+    """
+    if not any(param in request.args for param in ADMIN_QUERY_PARAMS):
+        emails = get_all_emails_from_csv()
+        return jsonify({'emails': emails})
+
+    try:
+        limit = min(max(int(request.args.get('limit', ADMIN_PAGE_SIZE)), 0), ADMIN_MAX_PAGE_SIZE)
+        after = decode_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+
+    sort = request.args.get('sort', 'desc')
+    if sort not in ('asc', 'desc'):
+        return jsonify({'error': 'sort must be asc or desc'}), 400
+
+    rows, total = waitlist_store.get_store().query(
+        q=request.args.get('q') or None,
+        domain=request.args.get('domain') or None,
+        start=request.args.get('from') or None,
+        end=request.args.get('to') or None,
+        sort=sort,
+        after=after,
+        limit=limit
+    )
+
+    next_cursor = None
+    if limit and len(rows) == limit:
+        next_cursor = encode_cursor(rows[-1])
+    emails = [{'email': row['email'], 'timestamp': row['timestamp']} for row in rows]
+    return jsonify({'emails': emails, 'next_cursor': next_cursor, 'total': total})
+
+def export_rows(rows, export_format, compress=False, chunk_size=64 * 1024):
+    """Serialize rows as CSV or NDJSON in chunks, gzip-compressing them if asked
+
+    Yields bytes; only one chunk is held in memory at a time.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 writes a gzip header
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+
+    def emit(final=False):
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate(0)
+        if compressor:
+            data = compressor.compress(data)
+            if final:
+                data += compressor.flush()
+        return data
+
+    if export_format == 'csv':
+        writer.writerow(['email', 'timestamp'])
+    for row in rows:
+        if export_format == 'csv':
+            writer.writerow([row['email'], row['timestamp']])
+        else:
+            buffer.write(json.dumps({'email': row['email'], 'timestamp': row['timestamp']}) + '\n')
+        if buffer.tell() >= chunk_size:
+            data = emit()
+            if data:
+                yield data
+
+    data = emit(final=True)
+    if data:
+        yield data
+
+@app.route('/api/admin/export', methods=['GET'])
+def admin_export():
+    """Stream the waitlist as CSV or NDJSON
+
+    Query parameters: format ('csv' or 'ndjson'), gzip ('1' for a .gz file),
+    from / to (timestamp range) and domain.
+    """
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+    rows = waitlist_store.get_store().iter_rows(
+        start=request.args.get('from') or None,
+        end=request.args.get('to') or None,
+        domain=request.args.get('domain') or None
+    )
+
+    filename = f"itza_waitlist_{datetime.now().strftime('%Y-%m-%d')}.{export_format}"
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    if compress:
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    response = app.response_class(export_rows(rows, export_format, compress), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/admin/emails/changes', methods=['GET'])
+def admin_get_email_changes():
+    """Get signups and removals since a change-feed cursor, for dashboard polling"""
+    return jsonify(get_changes(request.args.get('cursor')))
+
+@app.route('/api/admin/events', methods=['GET'])
+def admin_events():
+    """Stream signups, removals and campaign progress as Server-Sent Events"""
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('cursor')
+    response = app.response_class(stream_events(cursor), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return response
+
+@app.route('/api/admin/stats', methods=['GET'])
+def admin_stats():
+    """Get waitlist totals, signups per hour and day, top email domains and growth"""
+    try:
+        hours = min(int(request.args.get('hours', 24)), 24 * 31)
+        days = min(int(request.args.get('days', 30)), 366)
+    except ValueError:
+        return jsonify({'error': 'hours and days must be integers'}), 400
+
+    stats = get_waitlist_stats()
+    return cached_json_response(
+        lambda: jsonify(stats.snapshot(hours=max(hours, 1), days=max(days, 1))),
+        version=datetime.now().strftime('%Y-%m-%d %H')
+    )
+
+@app.route('/api/admin/index-stats', methods=['GET'])
+def admin_index_stats():
+    """Get size and hit/miss counters of the in-memory email index and admin response cache"""
+    index = get_email_index()
+    return jsonify({
+        'size': len(index),
+        'hits': email_index_stats['hits'],
+        'misses': email_index_stats['misses'],
+        'response_cache': dict(admin_response_stats, size=len(_admin_response_cache))
+    })
+
+@app.route('/api/admin/rate-limit-stats', methods=['GET'])
+def admin_rate_limit_stats():
+    """Get admitted/rejected counters of the signup rate limiters and the Klaviyo send rate"""
+    return jsonify({
+        'enabled': RATE_LIMIT_ENABLED,
+        'ip': ip_limiter.stats,
+        'email': email_limiter.stats,
+        'klaviyo': klaviyo_utils.send_limiter.snapshot()
+    })
 
 @app.route('/api/admin/resend', methods=['POST'])
 def admin_resend_email():
@@ -286,10 +1367,7 @@ def admin_resend_email():
         return jsonify({'error': 'Email is required'}), 400
     
     # Check if email exists in waitlist
-    emails = get_all_emails_from_csv()
-    email_exists = any(e['email'].lower() == email.lower() for e in emails)
-    
-    if not email_exists:
+    if not email_in_index(email):
         return jsonify({'error': 'Email not found in waitlist'}), 404
     
     # Resend confirmation email
@@ -310,6 +1388,15 @@ def admin_remove_email():
     if not email:
         return jsonify({'error': 'Email is required'}), 400
     
+    # Consult the index (refreshed from GitHub when configured) before touching any files
+    if GITHUB_TOKEN:
+        in_waitlist, _ = check_duplicate_email(email)
+    else:
+        in_waitlist = email_in_index(email)
+    
+    if not in_waitlist:
+        return jsonify({'error': 'Email not found or could not be removed'}), 404
+    
     # Remove from local CSV
     removed_from_csv = remove_email_from_csv(email)
     
@@ -317,233 +1404,277 @@ def admin_remove_email():
     removed_from_github = False
     if GITHUB_TOKEN:
         try:
-            # Get current content
-            is_duplicate, sha = check_duplicate_email(email)
-            if is_duplicate:
-                # Remove the email from GitHub
-                github_url = f'https://api.github.com/repos/{REPO_OWNER}/{REPO_NAME}/contents/{FILE_PATH}'
-                headers = {
-                    'Authorization': f'token {GITHUB_TOKEN}',
-                    'Accept': 'application/vnd.github.v3+json'
-                }
-                
-                # Get current content
-                response = requests.get(github_url, headers=headers)
-                if response.status_code == 200:
-                    content_data = response.json()
-                    current_content = base64.b64decode(content_data['content']).decode('utf-8')
-                    
-                    # Remove the email line
-                    new_content = ''
-                    for line in current_content.splitlines():
-                        if not line.lower().startswith(email.lower() + ','):
-                            new_content += line + '\n'
-                    
-                    # Update the file on GitHub
-                    update_data = {
-                        'message': f'Remove email {email} from waitlist',
-                        'content': base64.b64encode(new_content.encode('utf-8')).decode('utf-8'),
-                        'sha': content_data['sha']
-                    }
-                    
-                    update_response = requests.put(github_url, headers=headers, json=update_data)
-                    removed_from_github = update_response.status_code in (200, 201)
+            removed_from_github = bool(remove_from_github([email]))
         except Exception as e:
             log_error(e, "remove_email_from_github")
     
+    remove_from_email_index(email)
+    
     if removed_from_csv or removed_from_github:
         return jsonify({'message': f'Email {email} removed from waitlist'})
     else:
         return jsonify({'error': 'Email not found or could not be removed'}), 404
 
+def read_bulk_remove_emails():
+    """Get the addresses of a bulk removal from a JSON list or an uploaded file
+    
+    The file can be plain text with one address per line or a CSV whose first
+    column is the address (a header row is skipped).
+    """
+    if 'file' in request.files:
+        text = io.TextIOWrapper(request.files['file'].stream, encoding='utf-8', errors='replace')
+        return [row[0] for row in csv.reader(text) if row and row[0].strip().lower() != 'email']
+    
+    data = request.get_json(silent=True) or {}
+    emails = data.get('emails')
+    return emails if isinstance(emails, list) else None
+
+@app.route('/api/admin/remove-bulk', methods=['POST'])
+def admin_remove_emails_bulk():
+    """Remove a list of emails with one pass over the local store and one GitHub commit
+    
+    Accepts {"emails": [...]} or a multipart upload named "file". Returns the
+    result for every address: removed, not_found or invalid.
+    """
+    # Authentication is now handled on the frontend
+    emails = read_bulk_remove_emails()
+    if emails is None:
+        return jsonify({'error': 'A list of emails or a file is required'}), 400
+    if len(emails) > BULK_REMOVE_MAX:
+        return jsonify({'error': f'At most {BULK_REMOVE_MAX} emails per request'}), 400
+    
+    valid = [normalize_email(email) for email in emails if isinstance(email, str) and '@' in email]
+    removed = remove_emails_from_csv(valid)
+    
+    github_error = None
+    if GITHUB_TOKEN and valid:
+        try:
+            removed |= remove_from_github(valid)
+        except Exception as e:
+            log_error(e, "admin_remove_emails_bulk - GitHub")
+            github_error = str(e)
+    
+    # Drop them from GitHub files read before the removal too
+    for email in removed:
+        remove_from_email_index(email)
+    
+    results = []
+    for email in emails:
+        if not isinstance(email, str) or '@' not in email:
+            status = 'invalid'
+        elif normalize_email(email) in removed:
+            status = 'removed'
+        else:
+            status = 'not_found'
+        results.append({'email': email, 'status': status})
+    
+    response = {
+        'results': results,
+        'removed_count': sum(1 for result in results if result['status'] == 'removed'),
+        'not_found_count': sum(1 for result in results if result['status'] == 'not_found'),
+        'invalid_count': sum(1 for result in results if result['status'] == 'invalid')
+    }
+    if github_error:
+        response['github_error'] = github_error
+    return jsonify(response)
+
+def send_to_one(send, recipient_email):
+    """Send one email with a send_* wrapper and build the admin response counts"""
+    success = send(recipient_email)
+    return {
+        'success_count': 1 if success else 0,
+        'failure_count': 0 if success else 1,
+        'total_count': 1
+    }
+
+def start_campaign(campaign, label, resend=False):
+    """Queue a campaign job for the waitlist and return its id right away
+    
+    Recipients the sent ledger has as sent (or queued) for this campaign's
+    template are left out unless resend is set, so re-runs only send the delta.
+    The workers also claim each recipient right before sending (see
+    campaign_sender), so jobs submitted at the same time don't both send.
+    """
+    try:
+        all_emails = waitlist_store.get_store().emails()
+    except Exception as e:
+        log_error(e, f"start_campaign - reading waitlist for {campaign}")
+        return jsonify({'error': f'Failed to read email list: {str(e)}'}), 500
+    
+    skipped = 0
+    if not resend:
+        try:
+            all_emails, skipped = sent_ledger.get_ledger().unsent(campaign_ledger_key(campaign), all_emails)
+        except Exception as e:
+            log_error(e, f"start_campaign - reading sent ledger for {campaign}")
+            return jsonify({'error': f'Failed to read sent ledger: {str(e)}'}), 500
+    
+    engine = get_campaign_engine()
+    if engine is None:
+        return campaign_engine_unavailable()
+    if not CAMPAIGN_WORKERS_ENABLED:
+        print(f"Campaign workers are disabled in this process, the {campaign} job waits for a worker elsewhere")
+    # Pacing is left to klaviyo_utils.send_limiter, which adapts to Klaviyo's throttling
+    job_id = engine.submit(campaign, all_emails, resend=resend)
+    return jsonify({
+        'message': f'{label} queued for {len(all_emails)} recipients ({skipped} already sent)',
+        'job_id': job_id,
+        'total_count': len(all_emails),
+        'skipped_count': skipped,
+        'status_url': f'/api/admin/campaigns/{job_id}'
+    }), 202
+
 @app.route('/api/admin/send-educational-email', methods=['POST'])
 def admin_send_educational_email():
-    """Send educational email to all subscribers or a specific email"""
+    """Send educational email to a specific email, or queue a campaign job for all subscribers"""
     # Authentication is handled on the frontend
     data = request.json
     target_email = data.get('email')  # Optional, if None, send to all
     
-    success_count = 0
-    failure_count = 0
+    if not target_email:
+        return start_campaign('educational', 'Educational email', resend=bool(data.get('resend')))
     
-    # Read all emails from CSV
-    all_emails = []
     try:
-        csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'emails', 'waitlist.csv')
-        with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                all_emails.append(row['email'])
+        in_waitlist = waitlist_store.get_store().contains(target_email)
     except Exception as e:
-        log_error(e, "admin_send_educational_email - reading CSV")
+        log_error(e, "admin_send_educational_email - reading waitlist")
         return jsonify({'error': 'Failed to read email list'}), 500
+    if not in_waitlist:
+        return jsonify({'error': 'Email not found in waitlist'}), 404
     
-    # If target email is specified, only send to that email
-    if target_email:
-        if target_email in all_emails:
-            if send_educational_email(target_email):
-                success_count += 1
-            else:
-                failure_count += 1
-        else:
-            return jsonify({'error': 'Email not found in waitlist'}), 404
-    else:
-        # Send to all emails
-        for email in all_emails:
-            if send_educational_email(email):
-                success_count += 1
-            else:
-                failure_count += 1
-    
-    return jsonify({
-        'message': f'Educational email sent to {success_count} recipients',
-        'success_count': success_count,
-        'failure_count': failure_count,
-        'total_count': len(all_emails) if not target_email else 1
-    })
+    counts = send_to_one(send_educational_email, target_email)
+    return jsonify(dict(counts, message=f"Educational email sent to {counts['success_count']} recipients"))
 
 @app.route('/api/admin/send-brewing-guide', methods=['POST'])
 def admin_send_brewing_guide():
-    """Send brewing guide email to all subscribers or a specific email"""
+    """Send brewing guide email to a specific email, or queue a campaign job for all subscribers"""
     # Authentication is handled on the frontend
     data = request.json
     target_email = data.get('email')  # Optional, if None, send to all
     
-    success_count = 0
-    failure_count = 0
-    
-    # Read all emails from CSV
-    all_emails = []
-    try:
-        csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'emails', 'waitlist.csv')
-        with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            next(reader, None)  # Skip header row if it exists
-            for row in reader:
-                if row and len(row) > 0 and '@' in row[0]:
-                    all_emails.append(row[0])
-    except Exception as e:
-        log_error(e, "admin_send_brewing_guide - reading CSV")
-        return jsonify({'error': f'Failed to read email list: {str(e)}'}), 500
-    
-    # If target email is specified, only send to that email
-    if target_email:
-        if send_brewing_guide(target_email):
-            success_count += 1
-        else:
-            failure_count += 1
-    else:
-        # Send to all emails
-        for email in all_emails:
-            if send_brewing_guide(email):
-                success_count += 1
-            else:
-                failure_count += 1
+    if not target_email:
+        return start_campaign('brewing_guide', 'Brewing guide email', resend=bool(data.get('resend')))
     
-    return jsonify({
-        'message': f'Brewing guide email sent to {success_count} recipients',
-        'success_count': success_count,
-        'failure_count': failure_count,
-        'total_count': len(all_emails) if not target_email else 1
-    })
+    counts = send_to_one(send_brewing_guide, target_email)
+    return jsonify(dict(counts, message=f"Brewing guide email sent to {counts['success_count']} recipients"))
 
 @app.route('/api/admin/send-milestone-email', methods=['POST'])
 def admin_send_milestone_email():
-    """Send milestone celebration email to all subscribers or a specific email"""
+    """Send milestone celebration email to a specific email, or queue a campaign job for all subscribers"""
     # Authentication is handled on the frontend
     data = request.json
     target_email = data.get('email')  # Optional, if None, send to all
     
-    success_count = 0
-    failure_count = 0
-    
-    # Read all emails from CSV
-    all_emails = []
-    try:
-        csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'emails', 'waitlist.csv')
-        with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            next(reader, None)  # Skip header row if it exists
-            for row in reader:
-                if row and len(row) > 0 and '@' in row[0]:
-                    all_emails.append(row[0])
-    except Exception as e:
-        log_error(e, "admin_send_milestone_email - reading CSV")
-        return jsonify({'error': f'Failed to read email list: {str(e)}'}), 500
+    if not target_email:
+        return start_campaign('milestone', 'Milestone celebration email', resend=bool(data.get('resend')))
     
-    # If target email is specified, only send to that email
-    if target_email:
-        if send_milestone_email(target_email):
-            success_count += 1
-        else:
-            failure_count += 1
-    else:
-        # Send to all emails
-        for email in all_emails:
-            if send_milestone_email(email):
-                success_count += 1
-            else:
-                failure_count += 1
-    
-    return jsonify({
-        'message': f'Milestone celebration email sent to {success_count} recipients',
-        'success_count': success_count,
-        'failure_count': failure_count,
-        'total_count': len(all_emails) if not target_email else 1
-    })
+    counts = send_to_one(send_milestone_email, target_email)
+    return jsonify(dict(counts, message=f"Milestone celebration email sent to {counts['success_count']} recipients"))
 
 @app.route('/api/admin/send-update-email', methods=['POST'])
 def admin_send_update_email():
-    """Send update email to all subscribers or a specific email"""
+    """Send update email to a specific email, or queue a campaign job for all subscribers"""
     # Authentication is handled on the frontend
     data = request.json
     target_email = data.get('email')  # Optional, if None, send to all
     
-    success_count = 0
-    failure_count = 0
+    if not target_email:
+        return start_campaign('update', 'Update email', resend=bool(data.get('resend')))
     
-    # Read all emails from CSV
-    all_emails = []
-    try:
-        csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'emails', 'waitlist.csv')
-        with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            next(reader, None)  # Skip header row if it exists
-            for row in reader:
-                if row and len(row) > 0 and '@' in row[0]:
-                    all_emails.append(row[0])
-    except Exception as e:
-        log_error(e, "admin_send_update_email - reading CSV")
-        return jsonify({'error': f'Failed to read email list: {str(e)}'}), 500
+    counts = send_to_one(send_update_email, target_email)
+    return jsonify(dict(counts, message=f"Update email sent to {counts['success_count']} recipients"))
+
+@app.route('/api/admin/campaigns', methods=['GET'])
+def admin_list_campaigns():
+    """Get the most recent campaign jobs with their progress"""
+    engine = get_campaign_engine()
+    if engine is None:
+        return campaign_engine_unavailable()
+    return jsonify({'jobs': engine.list()})
+
+@app.route('/api/admin/campaigns/<job_id>', methods=['GET'])
+def admin_get_campaign(job_id):
+    """Get a campaign job's progress: sent, failed, queued, rate and ETA"""
+    engine = get_campaign_engine()
+    if engine is None:
+        return campaign_engine_unavailable()
+    job = engine.get(job_id)
+    if not job:
+        return jsonify({'error': 'Campaign job not found'}), 404
+    return jsonify(job)
+
+@app.route('/api/admin/campaigns/<job_id>/cancel', methods=['POST'])
+def admin_cancel_campaign(job_id):
+    """Cancel a queued or running campaign job"""
+    engine = get_campaign_engine()
+    if engine is None:
+        return campaign_engine_unavailable()
+    if not engine.cancel(job_id):
+        return jsonify({'error': 'Campaign job not found or already finished'}), 404
+    return jsonify(engine.get(job_id))
+
+@app.route('/api/admin/sent-ledger', methods=['GET'])
+def admin_sent_ledger():
+    """Query the sent ledger by campaign, email and status, with per-campaign counts
     
-    # If target email is specified, only send to that email
-    if target_email:
-        success, _ = send_update_email(target_email)
-        if success:
-            success_count += 1
-        else:
-            failure_count += 1
-    else:
-        # Send to all emails
-        for email in all_emails:
-            success, _ = send_update_email(email)
-            if success:
-                success_count += 1
-            else:
-                failure_count += 1
-            
-            # Add a small delay to avoid rate limiting
-            time.sleep(0.5)
+    campaign is a ledger key ('update' or 'update:<template id>'); a bare
+    campaign name is resolved with its current template.
+    """
+    campaign = request.args.get('campaign') or None
+    if campaign in CAMPAIGN_TEMPLATE_ENV:
+        campaign = campaign_ledger_key(campaign)
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 0), SENT_LEDGER_MAX_QUERY)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
     
-    return jsonify({
-        'message': f'Update email sent to {success_count} recipients',
-        'success_count': success_count,
-        'failure_count': failure_count,
-        'total_count': len(all_emails) if not target_email else 1
-    })
+    try:
+        ledger = sent_ledger.get_ledger()
+        entries = ledger.query(
+            campaign=campaign,
+            email=request.args.get('email') or None,
+            status=request.args.get('status') or None,
+            limit=limit
+        )
+        return jsonify({'entries': entries, 'summary': ledger.summary()})
+    except Exception as e:
+        log_error(e, "admin_sent_ledger")
+        return jsonify({'error': f'Failed to read sent ledger: {str(e)}'}), 500
 
 @app.route('/api/waitlist', methods=['POST'])
 def submit_email():
+    """Handle email submission for waitlist, replaying the original response for a repeated Idempotency-Key"""
+    rejected = check_rate_limit(ip_limiter, get_client_ip())
+    if rejected:
+        return rejected
+    
+    key = request.headers.get('Idempotency-Key', '').strip()
+    if not key:
+        return handle_waitlist_submission()
+    
+    fingerprint = request_fingerprint()
+    entry, is_first = claim_idempotency_key(key, fingerprint)
+    if not is_first:
+        if entry['fingerprint'] != fingerprint:
+            # Replaying would silently drop this request's email
+            return jsonify({'error': 'Idempotency-Key was already used with a different request body'}), 422
+        # Wait for the original request if it's still running
+        entry['done'].wait(timeout=30)
+        if entry['response'] is None:
+            return jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409
+        body, status, headers = entry['response']
+        response = app.response_class(body, status=status, headers=headers)
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+    
+    response = None
+    try:
+        response = make_response(handle_waitlist_submission())
+        return response
+    finally:
+        release_idempotency_key(key, entry, response)
+
+def handle_waitlist_submission():
     """Handle email submission for waitlist"""
     try:
         data = request.get_json()
@@ -551,37 +1682,70 @@ def submit_email():
             return jsonify({'error': 'Email is required'}), 400
 
         email = data['email'].strip().lower()
+        
+        rejected = check_rate_limit(email_limiter, normalize_email(email))
+        if rejected:
+            return rejected
+        
         print(f"Processing email submission for: {email}")
         
         # Check if this is for the next drop waitlist
         next_drop = data.get('next_drop', True)  # Default to next drop since we're sold out
         
-        # Save email to GitHub
-        result = save_to_github(email)
-        
-        if result == 'duplicate':
+        # Cheap in-memory check before any GitHub round-trip
+        if email_in_index(email):
             return jsonify({
                 'status': 'already_registered',
                 'message': "You're already on our waitlist!"
             })
-        elif result == 'success' or result == 'error':
-            # Even if GitHub save failed, we still try to send confirmation
-            if send_confirmation_email(email, next_drop):
-                return jsonify({
-                    'status': 'success',
-                    'message': "You're on the waitlist! Check your email for confirmation."
-                })
-            else:
-                return jsonify({
-                    'status': 'partial_success',
-                    'message': "You're on the waitlist! (Email confirmation failed)"
-                })
-        else:
-            return jsonify({'error': 'Failed to save email'}), 500
+        
+        # Ingest-only path while we're under a traffic spike
+        if surge_mode_active():
+            return ingest_signup(email, next_drop)
+        
+        track_inflight_signups(1)
+        try:
+            return process_signup(email, next_drop)
+        finally:
+            track_inflight_signups(-1)
 
     except Exception as e:
         error_msg = log_error(e, "submit_email")
         return jsonify({'error': 'Failed to save email', 'details': error_msg}), 500
 
+def process_signup(email, next_drop):
+    """Store a signup on GitHub and send the confirmation email"""
+    # Save email to GitHub
+    result = save_to_github(email)
+    
+    if result == 'duplicate':
+        return jsonify({
+            'status': 'already_registered',
+            'message': "You're already on our waitlist!"
+        })
+    elif result == 'success' or result == 'error':
+        # Even if GitHub save failed, we still try to send confirmation
+        if ASYNC_CONFIRMATION_EMAILS:
+            if dispatch_confirmation_email(email, next_drop):
+                return jsonify({
+                    'status': 'success',
+                    'email_status': 'queued',
+                    'message': "You're on the waitlist! Check your email for confirmation."
+                })
+        elif send_confirmation_email(email, next_drop):
+            return jsonify({
+                'status': 'success',
+                'email_status': 'sent',
+                'message': "You're on the waitlist! Check your email for confirmation."
+            })
+        
+        return jsonify({
+            'status': 'partial_success',
+            'email_status': 'failed',
+            'message': "You're on the waitlist! (Email confirmation failed)"
+        })
+    else:
+        return jsonify({'error': 'Failed to save email'}), 500
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Backfill the whole waitlist (emails/waitlist.csv or the configured store) into a Klaviyo list
+"""
+import sys
+import json
+import argparse
+import dotenv
+
+# Load environment variables before klaviyo_utils reads its configuration
+dotenv.load_dotenv()
+
+import klaviyo_utils
+import waitlist_store
+
+def waitlist_subscribers(source="Website Waitlist"):
+    """Yield (email, profile properties) for every live waitlist row, streaming the store"""
+    for row in waitlist_store.get_store().iter_rows():
+        if '@' not in row['email']:
+            continue
+        yield row['email'], {
+            "Source": source,
+            "Waitlist_Joined_At": row['timestamp']
+        }
+
+def backfill(list_id=None, next_drop=False, batch_size=klaviyo_utils.KLAVIYO_SUBSCRIBE_BATCH_SIZE, dry_run=False):
+    """Subscribe every waitlist email to a Klaviyo list in batched requests
+
+    Args:
+        list_id: Optional specific Klaviyo list ID (defaults to KLAVIYO_LIST_ID)
+        next_drop: If True, use the next drop list instead of the main list
+        batch_size: Profiles per request
+        dry_run: Only count the emails that would be sent
+
+    Returns:
+        list: (email, success boolean, message string) per subscriber
+    """
+    if dry_run:
+        emails = [email for email, _ in waitlist_subscribers()]
+        requests_needed = -(-len(emails) // batch_size)
+        print(f"DRY RUN: would subscribe {len(emails)} emails in {requests_needed} requests")
+        return []
+
+    return klaviyo_utils.add_subscribers_to_klaviyo(
+        waitlist_subscribers(),
+        list_id=list_id,
+        next_drop=next_drop,
+        batch_size=batch_size
+    )
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Backfill the waitlist into a Klaviyo list')
+    parser.add_argument('--list', type=str, help='Klaviyo list ID (default: KLAVIYO_LIST_ID)')
+    parser.add_argument('--next-drop', action='store_true', help='Use the next drop list (KLAVIYO_NEXT_DROP_LIST_ID)')
+    parser.add_argument('--batch-size', type=int, default=klaviyo_utils.KLAVIYO_SUBSCRIBE_BATCH_SIZE,
+                        help='Profiles per request (at most 100)')
+    parser.add_argument('--dry-run', action='store_true', help='Only count the emails, nothing is sent')
+    parser.add_argument('--results-json', type=str, help='Write the per-email results to this file')
+
+    args = parser.parse_args()
+
+    results = backfill(
+        list_id=args.list,
+        next_drop=args.next_drop,
+        batch_size=args.batch_size,
+        dry_run=args.dry_run
+    )
+    if args.dry_run:
+        sys.exit(0)
+
+    failed = [(email, message) for email, success, message in results if not success]
+    print(f"Backfill complete: {len(results) - len(failed)} added, {len(failed)} failed of {len(results)}")
+    for email, message in failed[:20]:
+        print(f"  {email}: {message}")
+    if len(failed) > 20:
+        print(f"  ... and {len(failed) - 20} more")
+
+    if args.results_json:
+        with open(args.results_json, 'w', encoding='utf-8') as f:
+            json.dump([{'email': email, 'success': success, 'message': message}
+                       for email, success, message in results], f, indent=2)
+        print(f"Wrote results to {args.results_json}")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Load-test the /api/waitlist signup path against local stand-ins for GitHub and Klaviyo
+
+Starts fake GitHub contents API and Klaviyo v1/v2 servers with configurable
+latency, error rate and 409/429 injection, points app.py and klaviyo_utils at
+them, drives concurrent signups and prints a JSON report with throughput,
+p50/p95/p99 latency and lost-write counts.
+
+App modes are picked up from the environment as usual, e.g.
+
+    GITHUB_GROUP_COMMIT=true python benchmark_signup.py --requests 500 --concurrency 50
+"""
+import os
+import sys
+import json
+import math
+import time
+import base64
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+class FaultConfig:
+    """Latency and fault injection settings for a fake server"""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, conflict_rate=0.0, throttle_rate=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.conflict_rate = conflict_rate
+        self.throttle_rate = throttle_rate
+
+    def delay(self):
+        """Sleep for the configured latency"""
+        latency = self.latency_ms + random.uniform(0, self.jitter_ms)
+        if latency:
+            time.sleep(latency / 1000.0)
+
+    def injected_status(self, allow_conflict=False):
+        """Pick an injected error status for this request, or None"""
+        roll = random.random()
+        if roll < self.error_rate:
+            return 500
+        roll -= self.error_rate
+        if roll < self.throttle_rate:
+            return 429
+        roll -= self.throttle_rate
+        if allow_conflict and roll < self.conflict_rate:
+            return 409
+        return None
+
+class FakeServer:
+    """Run a fake API server on a random local port in a background thread"""
+
+    def __init__(self, handler_class):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+class JSONHandler(BaseHTTPRequestHandler):
+    """Request handler with JSON helpers and quiet logging"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def send_json(self, status, body=None, headers=None):
+        data = json.dumps(body or {}).encode('utf-8') if status != 304 else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+def make_github_handler(faults, stats):
+    """Fake GitHub contents API (GET/PUT /repos/<owner>/<repo>/contents/<path>)"""
+    files = {}
+    lock = threading.Lock()
+
+    class GitHubHandler(JSONHandler):
+        def file_path(self):
+            return self.path.split('/contents/', 1)[1].split('?')[0]
+
+        def do_GET(self):
+            faults.delay()
+            stats.increment('github_get')
+            status = faults.injected_status()
+            if status:
+                stats.increment(f'github_injected_{status}')
+                return self.send_json(status, {'message': 'injected'}, {'Retry-After': '1'})
+
+            with lock:
+                content = files.get(self.file_path())
+            if content is None:
+                return self.send_json(404, {'message': 'Not Found'})
+
+            sha = hashlib.sha1(content).hexdigest()
+            etag = f'"{sha}"'
+            if self.headers.get('If-None-Match') == etag:
+                stats.increment('github_304')
+                return self.send_json(304)
+            if self.headers.get('Accept') == 'application/vnd.github.v3.raw':
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                return self.wfile.write(content)
+            self.send_json(200, {
+                'content': base64.b64encode(content).decode('utf-8'),
+                'sha': sha,
+                'size': len(content)
+            }, {'ETag': etag})
+
+        def do_PUT(self):
+            faults.delay()
+            stats.increment('github_put')
+            data = self.read_json()
+            status = faults.injected_status(allow_conflict=True)
+            if status:
+                stats.increment(f'github_injected_{status}')
+                return self.send_json(status, {'message': 'injected'}, {'Retry-After': '1'})
+
+            path = self.file_path()
+            new_content = base64.b64decode(data['content'])
+            with lock:
+                current = files.get(path)
+                current_sha = hashlib.sha1(current).hexdigest() if current is not None else None
+                if data.get('sha') != current_sha:
+                    stats.increment('github_409')
+                    return self.send_json(409, {'message': 'sha does not match'})
+                files[path] = new_content
+            self.send_json(200, {'content': {'sha': hashlib.sha1(new_content).hexdigest()}})
+
+    GitHubHandler.files = files
+    return GitHubHandler
+
+def make_klaviyo_handler(faults, stats):
+    """Fake Klaviyo list subscribe (v2) and transactional email (v1) endpoints"""
+
+    class KlaviyoHandler(JSONHandler):
+        def do_POST(self):
+            faults.delay()
+            data = self.read_json()
+            kind = 'subscribe' if '/subscribe' in self.path else 'email'
+            stats.increment(f'klaviyo_{kind}')
+            status = faults.injected_status()
+            if status:
+                stats.increment(f'klaviyo_injected_{status}')
+                return self.send_json(status, {'message': 'injected'}, {'Retry-After': '1'})
+            if kind == 'subscribe':
+                return self.send_json(200, [{'email': p.get('email')} for p in data.get('profiles', [])])
+            self.send_json(200, {'status': 'queued'})
+
+    return KlaviyoHandler
+
+class Counter(dict):
+    """Thread-safe dict of counters"""
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+
+    def increment(self, key):
+        with self.lock:
+            self[key] = self.get(key, 0) + 1
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+def run_benchmark(args):
+    """Run the load test and return the report dict"""
+    github_stats, klaviyo_stats = Counter(), Counter()
+    github_handler = make_github_handler(FaultConfig(
+        args.github_latency_ms, args.jitter_ms, args.github_error_rate,
+        args.conflict_rate, args.github_throttle_rate
+    ), github_stats)
+    github = FakeServer(github_handler).start()
+    klaviyo = FakeServer(make_klaviyo_handler(FaultConfig(
+        args.klaviyo_latency_ms, args.jitter_ms, args.klaviyo_error_rate,
+        0.0, args.klaviyo_throttle_rate
+    ), klaviyo_stats)).start()
+
+    # Seed the waitlist so reads cost what they would in production
+    seed = 'email,timestamp\n' + ''.join(f'seed{i}@example.com,2025-01-01 00:00:00\n' for i in range(args.seed))
+    github_handler.files['emails/waitlist.csv'] = seed.encode('utf-8')
+
+    # Keep every local file the app writes out of the real emails/ directory
+    work_dir = tempfile.mkdtemp(prefix='itza-bench-')
+    os.environ.update({
+        'GITHUB_TOKEN': 'bench-token',
+        'GITHUB_API_URL': github.url,
+        'KLAVIYO_API_KEY': 'bench-key',
+        'KLAVIYO_API_URL': klaviyo.url,
+        'KLAVIYO_LIST_ID': os.getenv('KLAVIYO_LIST_ID', 'BENCH'),
+        'KLAVIYO_NEXT_DROP_LIST_ID': os.getenv('KLAVIYO_NEXT_DROP_LIST_ID', 'BENCH'),
+        'KLAVIYO_WAITLIST_TEMPLATE_ID': os.getenv('KLAVIYO_WAITLIST_TEMPLATE_ID', 'BENCH'),
+        'KLAVIYO_NEXT_DROP_TEMPLATE_ID': os.getenv('KLAVIYO_NEXT_DROP_TEMPLATE_ID', 'BENCH'),
+        'WAITLIST_CSV_PATH': os.path.join(work_dir, 'waitlist.csv'),
+        'WAITLIST_DB_PATH': os.path.join(work_dir, 'waitlist.db'),
+        'WAITLIST_WAL_PATH': os.path.join(work_dir, 'waitlist.wal'),
+        'CAMPAIGN_DB_PATH': os.path.join(work_dir, 'campaign_jobs.db'),
+        'SENT_LEDGER_DB_PATH': os.path.join(work_dir, 'sent_ledger.db'),
+        'CAMPAIGN_CHECKPOINT_DIR': os.path.join(work_dir, 'checkpoints'),
+        'KLAVIYO_SYNC_STATE_PATH': os.path.join(work_dir, 'klaviyo_sync.json'),
+    })
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+
+    import app
+    import klaviyo_utils
+    klaviyo_utils.EMAIL_QUEUE_DIR = os.path.join(work_dir, 'queue')
+    klaviyo_utils.PROCESSED_DIR = os.path.join(work_dir, 'processed')
+    klaviyo_utils.FAILED_DIR = os.path.join(work_dir, 'failed')
+
+    emails = [f'bench{i}-{random.randrange(10**9)}@example.com' for i in range(args.requests)]
+    results = Counter()
+    latencies = []
+    accepted = []
+    latency_lock = threading.Lock()
+
+    def signup(email):
+        client = app.app.test_client()
+        started = time.perf_counter()
+        response = client.post('/api/waitlist', json={'email': email})
+        elapsed = (time.perf_counter() - started) * 1000.0
+        status = (response.get_json(silent=True) or {}).get('status', str(response.status_code))
+        results.increment(status)
+        with latency_lock:
+            latencies.append(elapsed)
+            if response.status_code in (200, 202) and status != 'already_registered':
+                accepted.append(email)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(signup, emails))
+    duration = time.perf_counter() - started
+
+    # Let write-behind modes finish before counting what made it to GitHub
+    if app.GITHUB_GROUP_COMMIT:
+        app.flush_github_buffer()
+    pending_wal = app.waitlist_wal.pending_count()
+
+    stored = set()
+    for path, content in list(github_handler.files.items()):
+        if path.endswith('.csv'):
+            stored |= app.parse_emails(content.decode('utf-8'))
+    lost = [email for email in accepted if email not in stored]
+
+    github.stop()
+    klaviyo.stop()
+
+    return {
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(args.requests / duration, 2) if duration else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 2),
+            'p95': round(percentile(latencies, 95), 2),
+            'p99': round(percentile(latencies, 99), 2),
+            'max': round(max(latencies), 2)
+        },
+        'responses': dict(results),
+        'accepted': len(accepted),
+        'lost_writes': len(lost),
+        'pending_wal': pending_wal,
+        'github': dict(github_stats),
+        'klaviyo': dict(klaviyo_stats),
+        'modes': {
+            'group_commit': app.GITHUB_GROUP_COMMIT,
+            'storage_layout': app.GITHUB_STORAGE_LAYOUT,
+            'async_confirmation': app.ASYNC_CONFIRMATION_EMAILS,
+            'surge': app.SURGE_MODE
+        }
+    }
+
+def main():
+    """Main function to parse command-line arguments and run the benchmark"""
+    parser = argparse.ArgumentParser(description='Load-test /api/waitlist against fake GitHub and Klaviyo servers')
+    parser.add_argument('--requests', type=int, default=200, help='Number of signups to send')
+    parser.add_argument('--concurrency', type=int, default=20, help='Concurrent clients')
+    parser.add_argument('--seed', type=int, default=1000, help='Emails already on the waitlist')
+    parser.add_argument('--github-latency-ms', type=float, default=80, help='GitHub API latency')
+    parser.add_argument('--klaviyo-latency-ms', type=float, default=120, help='Klaviyo API latency')
+    parser.add_argument('--jitter-ms', type=float, default=20, help='Random extra latency')
+    parser.add_argument('--github-error-rate', type=float, default=0.0, help='Fraction of GitHub calls failing with 500')
+    parser.add_argument('--conflict-rate', type=float, default=0.0, help='Fraction of GitHub PUTs failing with 409')
+    parser.add_argument('--github-throttle-rate', type=float, default=0.0, help='Fraction of GitHub calls failing with 429')
+    parser.add_argument('--klaviyo-error-rate', type=float, default=0.0, help='Fraction of Klaviyo calls failing with 500')
+    parser.add_argument('--klaviyo-throttle-rate', type=float, default=0.0, help='Fraction of Klaviyo calls failing with 429')
+    parser.add_argument('--output', type=str, help='Also write the JSON report to this file')
+
+    args = parser.parse_args()
+
+    # The app logs every request, keep stdout for the report
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        report = run_benchmark(args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+
+if __name__ == "__main__":
+    main()
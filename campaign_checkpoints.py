@@ -0,0 +1,85 @@
+"""
+Itza Yerba Mate - Campaign Checkpoints
+Append-only record of the recipients a bulk send has processed, so a crashed send can resume
+"""
+import os
+import hashlib
+import threading
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CHECKPOINT_DIR = os.getenv('CAMPAIGN_CHECKPOINT_DIR', os.path.join(BASE_DIR, 'emails', 'checkpoints'))
+
+# Outcomes that count as done; failed recipients are retried on resume
+DONE_OUTCOMES = ('sent', 'queued')
+
+def recipient_key(email):
+    """Compact key for a recipient (the address itself isn't stored)"""
+    return hashlib.sha1(email.strip().lower().encode('utf-8')).hexdigest()[:16]
+
+def new_campaign_id(prefix):
+    """Campaign id for a fresh send, e.g. order-20250101-120000"""
+    return f"{prefix}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+
+class CampaignCheckpoint:
+    """Checkpoint file of one campaign: a '<key> <outcome>' line per processed recipient
+
+    Lines are flushed as they are written, so after a crash at most the
+    recipients in flight are lost from the checkpoint (and sent again).
+    """
+
+    def __init__(self, campaign_id, directory=CHECKPOINT_DIR):
+        if not campaign_id or os.sep in campaign_id or campaign_id.startswith('.'):
+            raise ValueError(f"Invalid campaign id: {campaign_id}")
+        self.campaign_id = campaign_id
+        self.path = os.path.join(directory, f'{campaign_id}.ckpt')
+        self.lock = threading.Lock()
+        self.file = None
+
+    def exists(self):
+        """Whether anything has been recorded for this campaign"""
+        return os.path.exists(self.path)
+
+    def load(self):
+        """Get the latest outcome of every recorded recipient
+
+        Returns:
+            dict: recipient key -> outcome
+        """
+        outcomes = {}
+        if not self.exists():
+            return outcomes
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                key, _, outcome = line.strip().partition(' ')
+                if key and outcome:
+                    outcomes[key] = outcome
+        return outcomes
+
+    def pending(self, emails):
+        """Filter a recipient list down to those not done yet, in a single pass
+
+        Returns:
+            tuple: (emails still to send, number skipped)
+        """
+        outcomes = self.load()
+        remaining = [email for email in emails if outcomes.get(recipient_key(email)) not in DONE_OUTCOMES]
+        return remaining, len(emails) - len(remaining)
+
+    def record(self, email, outcome):
+        """Append a recipient's outcome ('sent', 'queued' or 'failed')"""
+        line = f'{recipient_key(email)} {outcome}\n'
+        with self.lock:
+            if self.file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.file = open(self.path, 'a', encoding='utf-8')
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        """Close the checkpoint file"""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
@@ -0,0 +1,304 @@
+"""
+Itza Yerba Mate - Campaign Jobs
+Background execution of bulk email campaigns, persisted in SQLite so they survive restarts
+"""
+import os
+import time
+import uuid
+import sqlite3
+import threading
+import traceback
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CAMPAIGN_DB_PATH = os.getenv('CAMPAIGN_DB_PATH', os.path.join(BASE_DIR, 'emails', 'campaign_jobs.db'))
+# A running job whose heartbeat is older than this is assumed orphaned and picked up again
+CAMPAIGN_STALE_AFTER = float(os.getenv('CAMPAIGN_STALE_AFTER', '60'))
+CAMPAIGN_POLL_INTERVAL = float(os.getenv('CAMPAIGN_POLL_INTERVAL', '2'))
+
+# Sender result for a recipient that didn't need the email (already sent by another job)
+SKIPPED = 'skipped'
+
+class CampaignEngine:
+    """Queue of campaign jobs and the worker threads that send them
+
+    Each job stores its recipient list and how far it got, so a worker that
+    restarts (or another worker, once the heartbeat goes stale) resumes it
+    where it stopped. At most the one email in flight when a worker died is
+    sent twice.
+    """
+
+    def __init__(self, senders, db_path=CAMPAIGN_DB_PATH, workers=1, on_progress=None, progress_every=10):
+        """
+        Args:
+            senders: Dict of campaign name -> function(email, resend) returning success or SKIPPED
+            db_path: SQLite database holding the jobs
+            workers: Number of worker threads
+            on_progress: Optional function(job dict) called as jobs advance
+            progress_every: Call on_progress every this many emails
+        """
+        self.senders = senders
+        self.db_path = db_path
+        self.workers = workers
+        self.on_progress = on_progress
+        self.progress_every = progress_every
+        self.owner = uuid.uuid4().hex
+        self.local = threading.local()
+        self.wakeup = threading.Event()
+        self.threads = []
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                campaign TEXT NOT NULL,
+                status TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                position INTEGER NOT NULL DEFAULT 0,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                skipped INTEGER NOT NULL DEFAULT 0,
+                delay REAL NOT NULL DEFAULT 0,
+                resend INTEGER NOT NULL DEFAULT 0,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                owner TEXT,
+                heartbeat REAL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                error TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS job_recipients (
+                job_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                email TEXT NOT NULL,
+                PRIMARY KEY (job_id, position)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)")
+        # Databases created before these columns existed
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column in ('skipped', 'resend'):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+        conn.commit()
+
+    def connection(self):
+        """Get this thread's connection to the database"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            self.local.conn = conn
+        return conn
+
+    def start(self):
+        """Start the worker threads (once); they also resume unfinished jobs"""
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self.worker_loop, name=f'campaign-worker-{i}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+        print(f"Started {self.workers} campaign worker(s)")
+
+    def submit(self, campaign, emails, delay=0.0, resend=False):
+        """Queue a campaign for a list of recipients
+
+        Args:
+            campaign: Name of a campaign in senders
+            emails: Recipient email addresses, sent in this order
+            delay: Seconds to wait between emails
+            resend: Passed to the sender, to send even to recipients who already got the email
+
+        Returns:
+            str: The job id
+        """
+        if campaign not in self.senders:
+            raise ValueError(f"Unknown campaign: {campaign}")
+
+        job_id = uuid.uuid4().hex[:12]
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO jobs (id, campaign, status, total, delay, resend, created_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, campaign, len(emails), delay, int(resend), time.time())
+            )
+            conn.executemany(
+                "INSERT INTO job_recipients (job_id, position, email) VALUES (?, ?, ?)",
+                ((job_id, position, email) for position, email in enumerate(emails))
+            )
+        print(f"Queued campaign job {job_id}: {campaign} to {len(emails)} recipients")
+        self.wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """Get a job's progress, or None if there is no such job"""
+        row = self.connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return describe_job(row) if row else None
+
+    def list(self, limit=50):
+        """Get the most recent jobs, newest first"""
+        cursor = self.connection().execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+        return [describe_job(row) for row in cursor]
+
+    def cancel(self, job_id):
+        """Cancel a job; a queued job stops at once, a running one before its next email
+
+        Returns:
+            bool: False if the job doesn't exist or has already finished
+        """
+        conn = self.connection()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id)
+            )
+            if cursor.rowcount:
+                return True
+            cursor = conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,)
+            )
+            return cursor.rowcount > 0
+
+    def claim(self):
+        """Take ownership of the next queued or orphaned job
+
+        Returns:
+            sqlite3.Row: The claimed job, or None
+        """
+        now = time.time()
+        conn = self.connection()
+        with conn:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' OR (status = 'running' AND heartbeat < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (now - CAMPAIGN_STALE_AFTER,)
+            ).fetchone()
+            if not row:
+                return None
+            # Conditional update so two workers can't both claim the job
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, heartbeat = ?, started_at = COALESCE(started_at, ?) "
+                "WHERE id = ? AND (status = 'queued' OR (status = 'running' AND heartbeat < ?))",
+                (self.owner, now, now, row['id'], now - CAMPAIGN_STALE_AFTER)
+            )
+            if not cursor.rowcount:
+                return None
+        return conn.execute("SELECT * FROM jobs WHERE id = ?", (row['id'],)).fetchone()
+
+    def worker_loop(self):
+        """Claim and run jobs until the process exits"""
+        while True:
+            try:
+                job = self.claim()
+                if job:
+                    self.run(job)
+                    continue
+            except Exception as e:
+                print(f"Campaign worker error: {e}\n{traceback.format_exc()}")
+            self.wakeup.wait(timeout=CAMPAIGN_POLL_INTERVAL)
+            self.wakeup.clear()
+
+    def run(self, job):
+        """Send a claimed job's remaining emails, recording progress after each one"""
+        job_id = job['id']
+        sender = self.senders.get(job['campaign'])
+        conn = self.connection()
+        if sender is None:
+            self.finish(job_id, 'failed', f"Unknown campaign: {job['campaign']}")
+            return
+
+        if job['position']:
+            print(f"Resuming campaign job {job_id} at {job['position']}/{job['total']}")
+        recipients = conn.execute(
+            "SELECT position, email FROM job_recipients WHERE job_id = ? AND position >= ? ORDER BY position",
+            (job_id, job['position'])
+        ).fetchall()
+
+        for position, email in recipients:
+            state = conn.execute("SELECT cancel_requested, owner FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if state['owner'] != self.owner:
+                print(f"Campaign job {job_id} was taken over by another worker")
+                return
+            if state['cancel_requested']:
+                self.finish(job_id, 'cancelled')
+                return
+
+            try:
+                result = sender(email, bool(job['resend']))
+                if result == SKIPPED:
+                    column = 'skipped'
+                else:
+                    success = result[0] if isinstance(result, tuple) else bool(result)
+                    column = 'sent' if success else 'failed'
+            except Exception as e:
+                print(f"Error sending {job['campaign']} to {email}: {e}")
+                column = 'failed'
+
+            with conn:
+                conn.execute(
+                    f"UPDATE jobs SET position = ?, {column} = {column} + 1, heartbeat = ? WHERE id = ?",
+                    (position + 1, time.time(), job_id)
+                )
+
+            done = position + 1
+            if self.on_progress and done % self.progress_every == 0 and done < job['total']:
+                self.on_progress(self.get(job_id))
+
+            if job['delay']:
+                time.sleep(job['delay'])
+
+        self.finish(job_id, 'completed')
+
+    def finish(self, job_id, status, error=None):
+        """Mark a job finished and report its final progress"""
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ?",
+                (status, time.time(), error, job_id)
+            )
+        job = self.get(job_id)
+        print(f"Campaign job {job_id} {status}: {job['sent']} sent, {job['failed']} failed, "
+              f"{job['skipped']} skipped of {job['total']}")
+        if self.on_progress:
+            self.on_progress(job)
+
+def describe_job(row):
+    """Turn a jobs row into a progress dict with rate (emails/second) and ETA (seconds)"""
+    processed = row['sent'] + row['failed'] + row['skipped']
+    queued = 0 if row['status'] in ('completed', 'cancelled', 'failed') else row['total'] - processed
+
+    rate = None
+    eta = None
+    if row['started_at'] and processed:
+        elapsed = (row['finished_at'] or time.time()) - row['started_at']
+        if elapsed > 0:
+            rate = processed / elapsed
+            eta = queued / rate if queued else 0.0
+
+    return {
+        'job_id': row['id'],
+        'campaign': row['campaign'],
+        'status': row['status'],
+        'total': row['total'],
+        'sent': row['sent'],
+        'failed': row['failed'],
+        'skipped': row['skipped'],
+        'queued': queued,
+        'rate': rate,
+        'eta_seconds': eta,
+        'cancel_requested': bool(row['cancel_requested']),
+        'created_at': row['created_at'],
+        'started_at': row['started_at'],
+        'finished_at': row['finished_at'],
+        'error': row['error']
+    }
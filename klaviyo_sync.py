@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Itza Yerba Mate - Klaviyo List Sync
+Incrementally push waitlist rows to a Klaviyo list, retrying the ones that failed
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import contextlib
+from datetime import datetime
+import dotenv
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, fall back to the in-process lock only
+    fcntl = None
+
+# Load environment variables before klaviyo_utils reads its configuration
+dotenv.load_dotenv()
+
+import klaviyo_utils
+import waitlist_store
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SYNC_STATE_PATH = os.getenv('KLAVIYO_SYNC_STATE_PATH', os.path.join(BASE_DIR, 'emails', 'klaviyo_sync.json'))
+SYNC_MAX_ATTEMPTS = int(os.getenv('KLAVIYO_SYNC_MAX_ATTEMPTS', '10'))  # Then a failed row is left for manual review
+
+_sync_lock = threading.Lock()
+
+@contextlib.contextmanager
+def locked_state(state_path):
+    """Hold an exclusive lock on the sync state so overlapping runs don't push the same rows"""
+    with _sync_lock:
+        os.makedirs(os.path.dirname(os.path.abspath(state_path)), exist_ok=True)
+        with open(state_path + '.lock', 'w', encoding='utf-8') as f:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def read_state(state_path=SYNC_STATE_PATH):
+    """Get the sync state of every list: {list_id: {'watermark', 'failed', 'last_run'}}"""
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def write_state(state, state_path=SYNC_STATE_PATH):
+    """Persist the sync state atomically"""
+    temp_path = state_path + '.temp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(temp_path, state_path)
+
+def subscriber_properties(row):
+    """Klaviyo profile properties of a waitlist row"""
+    return {
+        "Source": "Website Waitlist",
+        "Waitlist_Joined_At": row['timestamp']
+    }
+
+def sync_list(list_id=None, next_drop=False, batch_size=klaviyo_utils.KLAVIYO_SUBSCRIBE_BATCH_SIZE,
+              max_attempts=SYNC_MAX_ATTEMPTS, state_path=SYNC_STATE_PATH, verbose=True):
+    """Push waitlist rows added since the last run, plus earlier failures, to a Klaviyo list
+
+    The watermark only moves forward, and rows that fail are kept in the
+    state and retried on later runs, so a run with nothing new makes no API
+    calls. Failures whose address has since left the waitlist are dropped
+    instead of retried. The first run (no watermark yet) pushes the whole
+    waitlist.
+
+    Args:
+        list_id: Optional specific Klaviyo list ID (defaults to KLAVIYO_LIST_ID)
+        next_drop: If True, use the next drop list instead of the main list
+        batch_size: Profiles per request
+        max_attempts: Attempts before a failed row stops being retried
+        state_path: File holding the watermark and failures
+        verbose: Whether to print detailed logs
+
+    Returns:
+        dict: Counts of new, retried, synced, failed, given up and dropped rows
+    """
+    if not list_id:
+        list_id = klaviyo_utils.KLAVIYO_NEXT_DROP_LIST_ID if next_drop else klaviyo_utils.KLAVIYO_LIST_ID
+    if not klaviyo_utils.KLAVIYO_API_KEY or not list_id:
+        # Leave the watermark alone so nothing is skipped once Klaviyo is configured
+        print("Klaviyo API key or list ID not configured, nothing synced")
+        return None
+
+    with locked_state(state_path):
+        state = read_state(state_path)
+        list_state = state.setdefault(list_id, {'watermark': None, 'failed': {}})
+        failed = list_state['failed']
+
+        store = waitlist_store.get_store()
+        rows, watermark = store.rows_since(list_state['watermark'])
+        new_keys = {waitlist_store.normalize_email(row['email']) for row in rows}
+        # Removed (unsubscribed or deleted) since they failed, don't subscribe them again
+        dropped = [key for key, entry in failed.items() if key not in new_keys and not store.contains(entry['email'])]
+        for key in dropped:
+            del failed[key]
+        if verbose and dropped:
+            print(f"Dropped {len(dropped)} failed rows no longer on the waitlist")
+        retries = [entry for key, entry in failed.items()
+                   if entry['attempts'] < max_attempts and key not in new_keys]
+
+        subscribers = [(row['email'], subscriber_properties(row)) for row in rows]
+        subscribers += [(entry['email'], subscriber_properties(entry)) for entry in retries]
+        if verbose and subscribers:
+            print(f"Syncing {len(rows)} new and {len(retries)} failed rows to Klaviyo list {list_id}")
+
+        results = klaviyo_utils.add_subscribers_to_klaviyo(subscribers, list_id=list_id, batch_size=batch_size) \
+            if subscribers else []
+
+        timestamps = {waitlist_store.normalize_email(row['email']): row['timestamp'] for row in rows}
+        timestamps.update((waitlist_store.normalize_email(entry['email']), entry['timestamp']) for entry in retries)
+        synced = 0
+        given_up = 0
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        for email, success, message in results:
+            key = waitlist_store.normalize_email(email)
+            if success:
+                synced += 1
+                failed.pop(key, None)
+                continue
+            entry = failed.setdefault(key, {'email': email, 'timestamp': timestamps.get(key, ''), 'attempts': 0})
+            entry['attempts'] += 1
+            entry['error'] = message.strip()[:500]
+            entry['last_attempt'] = now
+            if entry['attempts'] == max_attempts:
+                given_up += 1
+                print(f"Giving up on syncing {email} after {max_attempts} attempts: {entry['error']}")
+
+        list_state['watermark'] = watermark
+        list_state['last_run'] = now
+        write_state(state, state_path)
+
+    summary = {
+        'list_id': list_id,
+        'new': len(rows),
+        'retried': len(retries),
+        'synced': synced,
+        'failed': len(results) - synced,
+        'given_up': given_up,
+        'dropped': len(dropped),
+        'pending_retry': sum(1 for entry in failed.values() if entry['attempts'] < max_attempts)
+    }
+    if verbose and subscribers:
+        print(f"Klaviyo sync complete: {summary['synced']} synced, {summary['failed']} failed "
+              f"({summary['pending_retry']} waiting for retry)")
+    return summary
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Push new waitlist rows to a Klaviyo list and retry failed ones')
+    parser.add_argument('--list', type=str, help='Klaviyo list ID (default: KLAVIYO_LIST_ID)')
+    parser.add_argument('--next-drop', action='store_true', help='Use the next drop list (KLAVIYO_NEXT_DROP_LIST_ID)')
+    parser.add_argument('--batch-size', type=int, default=klaviyo_utils.KLAVIYO_SUBSCRIBE_BATCH_SIZE,
+                        help='Profiles per request (at most 100)')
+    parser.add_argument('--max-attempts', type=int, default=SYNC_MAX_ATTEMPTS,
+                        help='Attempts before a failed row stops being retried')
+    parser.add_argument('--loop', type=float, help='Keep syncing, every N seconds')
+    parser.add_argument('--quiet', action='store_true', help='Suppress detailed logs')
+
+    args = parser.parse_args()
+
+    while True:
+        summary = sync_list(
+            list_id=args.list,
+            next_drop=args.next_drop,
+            batch_size=args.batch_size,
+            max_attempts=args.max_attempts,
+            verbose=not args.quiet
+        )
+        if summary is None:
+            sys.exit(1)
+
+        if not args.loop:
+            break
+        time.sleep(args.loop)
+
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -6,16 +6,36 @@ import os
 import json
 import time
 import requests
+import threading
 import traceback
+import contextlib
+from itertools import islice
 from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+import rate_limit
 
 # Klaviyo configuration
 KLAVIYO_API_KEY = os.getenv('KLAVIYO_API_KEY', '')
+KLAVIYO_API_URL = os.getenv('KLAVIYO_API_URL', 'https://a.klaviyo.com')
 KLAVIYO_LIST_ID = os.getenv('KLAVIYO_LIST_ID', '')  # For the main waitlist
 KLAVIYO_NEXT_DROP_LIST_ID = os.getenv('KLAVIYO_NEXT_DROP_LIST_ID', '')  # For next drop waitlist
+KLAVIYO_SUBSCRIBE_BATCH_SIZE = int(os.getenv('KLAVIYO_SUBSCRIBE_BATCH_SIZE', '100'))  # List subscribe accepts up to 100 profiles
+
+# Adaptive, process-wide pacing of bulk Klaviyo calls (calls per second). Only calls
+# made inside bulk_sending() wait for it; interactive calls (signup confirmations)
+# go out at once and just report what they see to the limiter.
+KLAVIYO_SEND_RATE = float(os.getenv('KLAVIYO_SEND_RATE', '5'))
+KLAVIYO_MIN_RATE = float(os.getenv('KLAVIYO_MIN_RATE', '0.5'))
+KLAVIYO_MAX_RATE = float(os.getenv('KLAVIYO_MAX_RATE', '25'))
+KLAVIYO_MAX_RETRIES = int(os.getenv('KLAVIYO_MAX_RETRIES', '3'))  # Retries of a throttled (429) call
+send_limiter = rate_limit.AdaptiveRateLimiter(KLAVIYO_SEND_RATE, KLAVIYO_MIN_RATE, KLAVIYO_MAX_RATE)
+_bulk_sending = threading.local()
 
 # Email queue directory (used as fallback if Klaviyo API is down)
 EMAIL_QUEUE_DIR = os.path.join('emails', 'queue')
+# Runs that retry the list subscribe of an already sent queued email before it is moved to failed
+EMAIL_QUEUE_SUBSCRIBE_ATTEMPTS = int(os.getenv('EMAIL_QUEUE_SUBSCRIBE_ATTEMPTS', '5'))
 PROCESSED_DIR = os.path.join('emails', 'processed')
 FAILED_DIR = os.path.join('emails', 'failed')
 
@@ -36,6 +56,96 @@ def ensure_directories():
     for directory in [EMAIL_QUEUE_DIR, PROCESSED_DIR, FAILED_DIR]:
         os.makedirs(os.path.join(os.path.dirname(os.path.abspath(__file__)), directory), exist_ok=True)
 
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delay in seconds or an HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def header_number(headers, *names):
+    """First of the named headers that holds a number, or None"""
+    for name in names:
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return float(value)
+        except ValueError:
+            continue
+    return None
+
+@contextlib.contextmanager
+def bulk_sending():
+    """Pace this thread's Klaviyo calls through send_limiter and wait out throttling
+    
+    For campaign jobs, send scripts and list syncs. Calls outside it never
+    sleep: a 429 is returned to the caller (which queues the email) instead.
+    """
+    _bulk_sending.depth = getattr(_bulk_sending, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _bulk_sending.depth -= 1
+
+def is_bulk_sending():
+    """Whether this thread is inside bulk_sending()"""
+    return getattr(_bulk_sending, 'depth', 0) > 0
+
+def klaviyo_post(url, headers, payload):
+    """POST to Klaviyo, paced by the shared send limiter for bulk senders
+    
+    Inside bulk_sending() every attempt waits for the limiter and a throttled
+    (429) call is retried up to KLAVIYO_MAX_RETRIES times after its
+    Retry-After. Other calls are made once, right away, so the signup path
+    never queues behind a campaign.
+    
+    Returns:
+        requests.Response: The last response
+    """
+    paced = is_bulk_sending()
+    for attempt in range(KLAVIYO_MAX_RETRIES + 1 if paced else 1):
+        if paced:
+            send_limiter.acquire()
+        response = requests.post(url, headers=headers, json=payload)
+        
+        if response.status_code == 429:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            send_limiter.throttled(retry_after)
+            if not paced:
+                print(f"Klaviyo throttled the request (Retry-After {retry_after}s), not waiting")
+                return response
+            print(f"Klaviyo throttled the request, retrying after {retry_after}s "
+                  f"(rate now {send_limiter.rate:.2f}/s)")
+            continue
+        
+        send_limiter.succeeded(
+            remaining=header_number(response.headers, 'RateLimit-Remaining', 'X-RateLimit-Remaining'),
+            reset=header_number(response.headers, 'RateLimit-Reset', 'X-RateLimit-Reset')
+        )
+        return response
+    
+    return response
+
+def build_subscriber_profile(email, profile_properties=None):
+    """Build the list-subscribe profile of an email address with optional extra properties"""
+    profile = {
+        "email": email,
+        "$consent": ["email"]  # Explicit opt-in
+    }
+    
+    # Add any additional profile properties
+    if profile_properties and isinstance(profile_properties, dict):
+        profile.update(profile_properties)
+    
+    return profile
+
 def add_subscriber_to_klaviyo(email, list_id=None, profile_properties=None, next_drop=False):
     """Add a subscriber to a Klaviyo list
     
@@ -60,29 +170,19 @@ def add_subscriber_to_klaviyo(email, list_id=None, profile_properties=None, next
     
     try:
         # Set up the API endpoint and headers
-        url = f"https://a.klaviyo.com/api/v2/list/{list_id}/subscribe"
+        url = f"{KLAVIYO_API_URL}/api/v2/list/{list_id}/subscribe"
         headers = {
             "Content-Type": "application/json",
             "Api-Key": KLAVIYO_API_KEY
         }
         
-        # Build the profile data
-        profile = {
-            "email": email,
-            "$consent": ["email"]  # Explicit opt-in
-        }
-        
-        # Add any additional profile properties
-        if profile_properties and isinstance(profile_properties, dict):
-            profile.update(profile_properties)
-        
         # Build the request payload
         payload = {
-            "profiles": [profile]
+            "profiles": [build_subscriber_profile(email, profile_properties)]
         }
         
         # Make the API request
-        response = requests.post(url, headers=headers, json=payload)
+        response = klaviyo_post(url, headers, payload)
         
         if response.status_code == 200:
             print(f"Successfully added {email} to Klaviyo list {list_id}")
@@ -96,6 +196,91 @@ def add_subscriber_to_klaviyo(email, list_id=None, profile_properties=None, next
         error_msg = log_error(e, "add_subscriber_to_klaviyo")
         return False, error_msg
 
+def add_subscribers_to_klaviyo(subscribers, list_id=None, next_drop=False, batch_size=KLAVIYO_SUBSCRIBE_BATCH_SIZE):
+    """Add many subscribers to a Klaviyo list, batch_size profiles per request
+    
+    Args:
+        subscribers: Iterable of email addresses or (email, profile properties dict) pairs
+        list_id: Optional specific Klaviyo list ID (defaults to KLAVIYO_LIST_ID)
+        next_drop: If True, add to the next drop list instead of the main list
+        batch_size: Profiles per request (Klaviyo accepts at most 100)
+        
+    Returns:
+        list: (email, success boolean, message string) per subscriber, in input order
+    """
+    subscribers = ((item, None) if isinstance(item, str) else item for item in subscribers)
+    
+    # Determine which list to use
+    if not list_id:
+        list_id = KLAVIYO_NEXT_DROP_LIST_ID if next_drop else KLAVIYO_LIST_ID
+    
+    if not KLAVIYO_API_KEY or not list_id:
+        message = "Klaviyo list ID not configured" if KLAVIYO_API_KEY else "Klaviyo API key not configured"
+        return [(email, False, message) for email, _ in subscribers]
+    
+    url = f"{KLAVIYO_API_URL}/api/v2/list/{list_id}/subscribe"
+    headers = {
+        "Content-Type": "application/json",
+        "Api-Key": KLAVIYO_API_KEY
+    }
+    
+    results = []
+    batch_size = max(1, min(batch_size, 100))
+    while True:
+        batch = list(islice(subscribers, batch_size))
+        if not batch:
+            break
+        
+        # Leave out addresses Klaviyo would reject, so they can't fail the whole batch
+        profiles = []
+        batch_results = {}
+        for position, (email, profile_properties) in enumerate(batch):
+            email = (email or '').strip()
+            if '@' not in email:
+                batch_results[position] = (email, False, "Invalid email address")
+            else:
+                profiles.append((position, build_subscriber_profile(email, profile_properties)))
+        
+        if profiles:
+            with bulk_sending():
+                batch_results.update(subscribe_batch(url, headers, profiles))
+        results.extend(batch_results[position] for position in range(len(batch)))
+        
+        added = sum(1 for _, success, _ in results if success)
+        print(f"Klaviyo list {list_id}: {added}/{len(results)} subscribers added so far")
+    
+    return results
+
+def subscribe_batch(url, headers, profiles):
+    """Send one list-subscribe request for a batch of (position, profile) pairs
+    
+    Returns:
+        dict: position -> (email, success boolean, message string)
+    """
+    emails = {position: profile["email"] for position, profile in profiles}
+    try:
+        response = klaviyo_post(url, headers, {"profiles": [profile for _, profile in profiles]})
+    except Exception as e:
+        error_msg = log_error(e, "add_subscribers_to_klaviyo")
+        return {position: (email, False, error_msg) for position, email in emails.items()}
+    
+    if response.status_code != 200:
+        error_msg = f"Klaviyo API error: {response.status_code} - {response.text}"
+        print(error_msg)
+        return {position: (email, False, error_msg) for position, email in emails.items()}
+    
+    # The response lists the profiles subscribed right away; the rest were
+    # accepted but are pending double opt-in or suppressed
+    try:
+        subscribed = {item.get("email", "").lower() for item in response.json() if isinstance(item, dict)}
+    except ValueError:
+        subscribed = set()
+    return {
+        position: (email, True, "Subscriber added successfully" if email.lower() in subscribed
+                   else "Subscriber accepted (pending confirmation or suppressed)")
+        for position, email in emails.items()
+    }
+
 def send_transactional_email(email, template_id, template_variables=None):
     """Send a transactional email using Klaviyo
     
@@ -112,7 +297,7 @@ def send_transactional_email(email, template_id, template_variables=None):
     
     try:
         # Set up the API endpoint and headers
-        url = "https://a.klaviyo.com/api/v1/email"
+        url = f"{KLAVIYO_API_URL}/api/v1/email"
         headers = {
             "Content-Type": "application/json",
             "Api-Key": KLAVIYO_API_KEY
@@ -136,7 +321,7 @@ def send_transactional_email(email, template_id, template_variables=None):
                 payload["subject"] = template_variables["subject"]
         
         # Make the API request
-        response = requests.post(url, headers=headers, json=payload)
+        response = klaviyo_post(url, headers, payload)
         
         if response.status_code == 200:
             print(f"Successfully sent email to {email} using Klaviyo template {template_id}")
@@ -150,7 +335,7 @@ def send_transactional_email(email, template_id, template_variables=None):
         error_msg = log_error(e, "send_transactional_email")
         return False, error_msg
 
-def queue_email(recipient_email, template_id, template_variables=None, email_type="confirmation"):
+def queue_email(recipient_email, template_id, template_variables=None, email_type="confirmation", subscribe=None):
     """Save email to queue for later processing
     
     Args:
@@ -158,6 +343,7 @@ def queue_email(recipient_email, template_id, template_variables=None, email_typ
         template_id: Klaviyo template ID
         template_variables: Template variables to pass to Klaviyo
         email_type: Type of email (e.g., 'confirmation', 'educational', 'order')
+        subscribe: Optional {'next_drop', 'profile_properties'} to also add the recipient to a list
     
     Returns:
         tuple: (success boolean, filepath string)
@@ -178,6 +364,8 @@ def queue_email(recipient_email, template_id, template_variables=None, email_typ
             'type': email_type,
             'attempts': 0
         }
+        if subscribe:
+            email_data['subscribe'] = subscribe
         
         # Save to queue file
         with open(filepath, 'w', encoding='utf-8') as file:
@@ -190,6 +378,54 @@ def queue_email(recipient_email, template_id, template_variables=None, email_typ
         error_msg = log_error(e, "queue_email")
         return False, error_msg
 
+def get_waitlist_confirmation_template_id(next_drop=False):
+    """Get the Klaviyo template ID for the waitlist confirmation email"""
+    # Template IDs for different email types (these would be the actual IDs from your Klaviyo account)
+    TEMPLATE_IDS = {
+        'waitlist_confirmation': os.getenv('KLAVIYO_WAITLIST_TEMPLATE_ID', ''),
+        'next_drop_confirmation': os.getenv('KLAVIYO_NEXT_DROP_TEMPLATE_ID', ''),
+    }
+    
+    return TEMPLATE_IDS['next_drop_confirmation'] if next_drop else TEMPLATE_IDS['waitlist_confirmation']
+
+def get_waitlist_confirmation_variables(email):
+    """Template variables for the waitlist confirmation email"""
+    return {
+        "email": email,
+        "subject": "Thanks for Joining Itza Yerba Mate's Waitlist!",
+        "first_name": email.split('@')[0]  # Basic personalization as fallback
+    }
+
+def get_waitlist_subscriber_properties(next_drop=False):
+    """Get the profile properties waitlist signups are added to Klaviyo lists with"""
+    return {
+        "Source": "Website Waitlist",
+        "Joined_Next_Drop_Waitlist": next_drop
+    }
+
+def queue_waitlist_confirmation_email(email, next_drop=False):
+    """Queue a waitlist confirmation email for process_email_queue without calling Klaviyo
+    
+    The list subscribe is queued with it, since it hasn't happened either.
+    
+    Args:
+        email: The subscriber's email address
+        next_drop: Whether this is for the next drop waitlist
+        
+    Returns:
+        tuple: (success boolean, filepath string)
+    """
+    return queue_email(
+        email,
+        get_waitlist_confirmation_template_id(next_drop),
+        get_waitlist_confirmation_variables(email),
+        "waitlist_confirmation" if not next_drop else "next_drop_confirmation",
+        subscribe={
+            'next_drop': next_drop,
+            'profile_properties': get_waitlist_subscriber_properties(next_drop)
+        }
+    )
+
 def send_waitlist_confirmation_email(email, next_drop=False):
     """Send confirmation email to new waitlist subscribers
     
@@ -200,13 +436,7 @@ def send_waitlist_confirmation_email(email, next_drop=False):
     Returns:
         tuple: (success boolean, message string)
     """
-    # Template IDs for different email types (these would be the actual IDs from your Klaviyo account)
-    TEMPLATE_IDS = {
-        'waitlist_confirmation': os.getenv('KLAVIYO_WAITLIST_TEMPLATE_ID', ''),
-        'next_drop_confirmation': os.getenv('KLAVIYO_NEXT_DROP_TEMPLATE_ID', ''),
-    }
-    
-    template_id = TEMPLATE_IDS['next_drop_confirmation'] if next_drop else TEMPLATE_IDS['waitlist_confirmation']
+    template_id = get_waitlist_confirmation_template_id(next_drop)
     
     if not template_id:
         return False, "Klaviyo template ID not configured"
@@ -215,21 +445,14 @@ def send_waitlist_confirmation_email(email, next_drop=False):
     list_success, list_message = add_subscriber_to_klaviyo(
         email, 
         next_drop=next_drop,
-        profile_properties={
-            "Source": "Website Waitlist",
-            "Joined_Next_Drop_Waitlist": next_drop
-        }
+        profile_properties=get_waitlist_subscriber_properties(next_drop)
     )
     
     if not list_success:
         print(f"Warning: Failed to add {email} to Klaviyo list: {list_message}")
     
     # Set up template variables
-    template_variables = {
-        "email": email,
-        "subject": "Thanks for Joining Itza Yerba Mate's Waitlist!",
-        "first_name": email.split('@')[0]  # Basic personalization as fallback
-    }
+    template_variables = get_waitlist_confirmation_variables(email)
     
     # Send the email
     success, message = send_transactional_email(
@@ -318,6 +541,15 @@ def process_email_queue():
     
     print(f"Found {len(queued_files)} emails in queue")
     
+    with bulk_sending():
+        return process_queued_files(queue_dir, processed_dir, failed_dir, queued_files)
+
+def process_queued_files(queue_dir, processed_dir, failed_dir, queued_files):
+    """Send the queued email files, moving each to processed or failed
+    
+    Returns:
+        int: number of emails sent
+    """
     processed_count = 0
     for filename in queued_files:
         filepath = os.path.join(queue_dir, filename)
@@ -333,22 +565,58 @@ def process_email_queue():
             
             print(f"Processing email to {to_email}")
             
-            # Attempt to send the email via Klaviyo
-            success, message = send_transactional_email(
-                to_email,
-                template_id,
-                template_variables
-            )
+            # Emails queued before reaching Klaviyo still need their list subscribe
+            subscribe = email_data.get('subscribe')
+            if subscribe:
+                list_success, list_message = add_subscriber_to_klaviyo(
+                    to_email,
+                    next_drop=subscribe.get('next_drop', False),
+                    profile_properties=subscribe.get('profile_properties')
+                )
+                if list_success:
+                    subscribe = None
+                else:
+                    email_data['subscribe_attempts'] = email_data.get('subscribe_attempts', 0) + 1
+                    email_data['subscribe_error'] = str(list_message)[:500]
+                    print(f"Warning: Failed to add {to_email} to Klaviyo list: {list_message}")
+            
+            # Attempt to send the email via Klaviyo (unless an earlier run already did)
+            if email_data.get('sent'):
+                success, message = True, "Already sent"
+            else:
+                success, message = send_transactional_email(
+                    to_email,
+                    template_id,
+                    template_variables
+                )
+                email_data['attempts'] = email_data.get('attempts', 0) + 1
+                if success:
+                    processed_count += 1
+                    email_data['sent'] = True
+            
+            if success and subscribe and email_data['subscribe_attempts'] < EMAIL_QUEUE_SUBSCRIBE_ATTEMPTS:
+                # Keep only the list subscribe in the queue for the next run
+                with open(filepath, 'w', encoding='utf-8') as f:
+                    json.dump(email_data, f, indent=2)
+                print(f"Sent email to {to_email}, list subscribe left in the queue")
+                continue
             
             # Move file to appropriate directory
-            if success:
+            if success and not subscribe:
                 target_dir = processed_dir
                 print(f"Successfully sent email to {to_email}")
-                processed_count += 1
+            elif success:
+                target_dir = failed_dir
+                print(f"Sent email to {to_email} but gave up on the list subscribe after "
+                      f"{email_data['subscribe_attempts']} attempts: {email_data['subscribe_error']}")
             else:
                 target_dir = failed_dir
+                email_data['error'] = str(message)[:500]
                 print(f"Failed to send email to {to_email}: {message}")
             
+            # Keep the outcome (sent state and errors) in the file
+            with open(filepath, 'w', encoding='utf-8') as f:
+                json.dump(email_data, f, indent=2)
             target_path = os.path.join(target_dir, filename)
             os.rename(filepath, target_path)
             
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Replay signups accepted in surge mode from the waitlist write-ahead log into GitHub and Klaviyo
+"""
+import sys
+import time
+import argparse
+import dotenv
+
+# Load environment variables before app reads its configuration
+dotenv.load_dotenv()
+
+import app
+import waitlist_wal
+
+def drain_wal(rate=2.0, max_entries=None, verbose=True):
+    """Replay pending WAL entries at a controlled rate
+    
+    Each entry goes through the normal signup path (save_to_github, then the
+    confirmation email). The replayed offset is saved after every entry, and an
+    entry replayed twice after a crash is caught by the duplicate check.
+    
+    Args:
+        rate: Maximum entries replayed per second
+        max_entries: Maximum number of entries to replay (None for all)
+        verbose: Whether to print detailed logs
+        
+    Returns:
+        tuple: (replayed_count, duplicate_count, email_failed_count)
+    """
+    entries = waitlist_wal.read_pending(limit=max_entries)
+    if verbose:
+        print(f"Found {len(entries)} signups in the WAL")
+    
+    replayed_count = 0
+    duplicate_count = 0
+    email_failed_count = 0
+    delay = 1.0 / rate if rate else 0
+    
+    for offset, entry in entries:
+        started = time.time()
+        email = entry['email']
+        next_drop = entry.get('next_drop', True)
+        
+        result = app.save_to_github(email, entry.get('timestamp'))
+        if result == 'duplicate':
+            duplicate_count += 1
+            if verbose:
+                print(f"Already on the waitlist: {email}")
+        else:
+            if not app.send_confirmation_email(email, next_drop):
+                email_failed_count += 1
+            if verbose:
+                print(f"Replayed {email} ({result})")
+        
+        waitlist_wal.write_offset(offset)
+        replayed_count += 1
+        
+        # Stay under the configured rate
+        elapsed = time.time() - started
+        if elapsed < delay:
+            time.sleep(delay - elapsed)
+    
+    waitlist_wal.truncate_if_drained()
+    return replayed_count, duplicate_count, email_failed_count
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Replay surge-mode signups from the waitlist WAL')
+    parser.add_argument('--rate', type=float, default=2.0, help='Maximum signups replayed per second')
+    parser.add_argument('--max', type=int, help='Maximum number of signups to replay')
+    parser.add_argument('--loop', type=float, help='Keep draining, polling the WAL every N seconds')
+    parser.add_argument('--quiet', action='store_true', help='Suppress detailed logs')
+    
+    args = parser.parse_args()
+    
+    while True:
+        replayed, duplicates, email_failed = drain_wal(
+            rate=args.rate,
+            max_entries=args.max,
+            verbose=not args.quiet
+        )
+        
+        if replayed or not args.quiet:
+            print(f"WAL drain complete: {replayed} replayed, {duplicates} duplicates, {email_failed} confirmation failures")
+        
+        if not args.loop:
+            break
+        time.sleep(args.loop)
+    
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
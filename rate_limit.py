@@ -0,0 +1,213 @@
+"""
+Itza Yerba Mate - Rate Limiting
+Token-bucket admission control with pluggable bucket storage (in-process or shared SQLite)
+"""
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MEMORY_MAX_BUCKETS = int(os.getenv('RATE_LIMIT_MAX_BUCKETS', '100000'))
+
+class MemoryBucketBackend:
+    """Token buckets kept in this process only
+
+    Buckets are kept in least-recently-used order. Each call drops a couple
+    of buckets from the old end if they would be full by now (they carry no
+    state), and evicts the oldest past max_buckets, so a flood of new keys
+    costs O(1) per request rather than a sweep of the whole dict.
+    """
+
+    def __init__(self, max_buckets=MEMORY_MAX_BUCKETS):
+        self.buckets = OrderedDict()  # key -> (tokens, updated, time it is full again)
+        self.max_buckets = max_buckets
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, refill_rate, now=None):
+        """Take one token from a bucket
+
+        Returns:
+            tuple: (allowed boolean, seconds until a token is available)
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            # Popped and re-inserted so the bucket moves to the recent end
+            tokens, updated, _ = self.buckets.pop(key, (capacity, now, now))
+            allowed, tokens, retry_after = _refill_and_take(tokens, updated, capacity, refill_rate, now)
+            full_at = now + (capacity - tokens) / refill_rate if refill_rate > 0 else float('inf')
+            self.buckets[key] = (tokens, now, full_at)
+            self.prune(now)
+        return allowed, retry_after
+
+    def prune(self, now, batch=2):
+        """Drop up to batch refilled buckets from the old end, then evict the oldest past max_buckets"""
+        for _ in range(batch):
+            if not self.buckets or next(iter(self.buckets.values()))[2] > now:
+                break
+            self.buckets.popitem(last=False)
+        while len(self.buckets) > self.max_buckets:
+            self.buckets.popitem(last=False)
+
+class SQLiteBucketBackend:
+    """Token buckets in a SQLite file so every worker on the host shares the same limits"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.path.join(BASE_DIR, 'emails', 'rate_limits.db')
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+        conn.commit()
+
+    def connection(self):
+        """Get this thread's connection to the database"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            self.local.conn = conn
+        return conn
+
+    def take(self, key, capacity, refill_rate, now=None):
+        """Take one token from a bucket
+
+        Returns:
+            tuple: (allowed boolean, seconds until a token is available)
+        """
+        now = time.time() if now is None else now
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            allowed, tokens, retry_after = _refill_and_take(tokens, updated, capacity, refill_rate, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                (key, tokens, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, retry_after
+
+def _refill_and_take(tokens, updated, capacity, refill_rate, now):
+    """Refill a bucket for the time elapsed and try to take a token
+
+    Returns:
+        tuple: (allowed, tokens left, seconds until the next token)
+    """
+    tokens = min(capacity, tokens + max(0.0, now - updated) * refill_rate)
+    if tokens >= 1:
+        return True, tokens - 1, 0.0
+    retry_after = (1 - tokens) / refill_rate if refill_rate > 0 else float('inf')
+    return False, tokens, retry_after
+
+BACKENDS = {
+    'memory': MemoryBucketBackend,
+    'sqlite': SQLiteBucketBackend,
+}
+
+class TokenBucketLimiter:
+    """Per-key token buckets with a fixed burst (capacity) and refill rate (tokens per second)"""
+
+    def __init__(self, name, capacity, refill_rate, backend):
+        self.name = name
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.backend = backend
+        self.stats = {'admitted': 0, 'rejected': 0}
+        self.lock = threading.Lock()
+
+    def allow(self, key):
+        """Check whether a request for key is admitted
+
+        Returns:
+            tuple: (allowed boolean, seconds until the next request would be admitted)
+        """
+        allowed, retry_after = self.backend.take(f'{self.name}:{key}', self.capacity, self.refill_rate)
+        with self.lock:
+            self.stats['admitted' if allowed else 'rejected'] += 1
+        return allowed, retry_after
+
+def create_backend(name=None):
+    """Create a bucket backend by name ('memory' or 'sqlite')"""
+    name = name or os.getenv('RATE_LIMIT_BACKEND', 'memory')
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown rate limit backend: {name}")
+    return BACKENDS[name]()
+
+class AdaptiveRateLimiter:
+    """Process-wide pacer for calls to a throttled API
+
+    Spaces calls 1/rate apart across all threads. The rate creeps up while
+    calls succeed (additive increase) and halves when the API throttles
+    (multiplicative decrease). A Retry-After or an exhausted quota pauses
+    every caller until the API says it's fine to continue.
+    """
+
+    def __init__(self, rate, min_rate, max_rate, increase=1.0):
+        """
+        Args:
+            rate: Starting calls per second
+            min_rate, max_rate: Bounds for the adapted rate
+            increase: Calls per second added for each second's worth of successful calls
+        """
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.next_slot = 0.0
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.stats = {'calls': 0, 'throttled': 0, 'waited_seconds': 0.0}
+
+    def acquire(self):
+        """Block until this caller's turn to make a call"""
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_slot, self.paused_until)
+            self.next_slot = slot + 1.0 / self.rate
+            self.stats['calls'] += 1
+            self.stats['waited_seconds'] += slot - now
+        if slot > now:
+            time.sleep(slot - now)
+
+    def succeeded(self, remaining=None, reset=None):
+        """Record a successful call, with the API's rate-limit headers if it sent them
+
+        Args:
+            remaining: Calls left in the current quota window
+            reset: Seconds until the quota window resets
+        """
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+            if remaining is not None and remaining <= 0 and reset:
+                self.pause(reset)
+
+    def throttled(self, retry_after=None):
+        """Record a throttled call (429) and back off"""
+        with self.lock:
+            self.stats['throttled'] += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.pause(retry_after if retry_after is not None else 1.0 / self.rate)
+
+    def pause(self, seconds):
+        """Hold every caller for seconds (call with the lock held)"""
+        self.paused_until = max(self.paused_until, time.time() + seconds)
+        self.next_slot = max(self.next_slot, self.paused_until)
+
+    def snapshot(self):
+        """Current rate and counters"""
+        with self.lock:
+            return dict(self.stats, rate=self.rate, paused_for=max(0.0, self.paused_until - time.time()))
@@ -1,31 +1,25 @@
 import os
-import csv
 import json
 import time
 import requests
+import threading
 import traceback
 from datetime import datetime
 import dotenv
 # Import the centralized email utilities
 import klaviyo_utils
+import waitlist_store
+import rate_limit
+import campaign_checkpoints
+import sent_ledger
 
 # Load environment variables
 dotenv.load_dotenv()
 
 def read_waitlist():
-    """Read emails from the waitlist.csv file"""
-    waitlist_path = os.path.join('emails', 'waitlist.csv')
-    
-    if not os.path.exists(waitlist_path):
-        print(f"Waitlist file not found: {waitlist_path}")
-        return []
-    
+    """Read emails from the waitlist store (removals already applied)"""
     try:
-        emails = []
-        with open(waitlist_path, 'r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                emails.append(row['email'])
+        emails = waitlist_store.get_store().emails()
         
         print(f"Read {len(emails)} emails from waitlist")
         return emails
@@ -49,8 +43,26 @@ def read_email_template():
         print(f"Error reading email template: {str(e)}")
         return None
 
-def send_announcement_emails(test_mode=False, specific_email=None, start_index=0, batch_size=None):
-    """Send announcement emails to everyone on the waitlist"""
+def send_announcement_emails(test_mode=False, specific_email=None, start_index=0, batch_size=None,
+                             concurrency=1, rate=0, progress_interval=5.0, summary_path=None,
+                             campaign_id=None, resume=False, resend=False):
+    """Send announcement emails to everyone on the waitlist
+    
+    Args:
+        test_mode: Only list the recipients
+        specific_email: Send to this address only
+        start_index, batch_size: Send to emails[start_index:start_index + batch_size] only
+        concurrency: Number of sends in flight at once
+        rate: Optional cap on sends per second across all workers (0 for none)
+        progress_interval: Seconds between progress lines
+        summary_path: Optional file for the JSON summary ('-' for stdout)
+        campaign_id: Id of the campaign checkpoint (a new one is made up if not given)
+        resume: Continue campaign_id, skipping recipients its checkpoint has as sent or queued
+        resend: Also send to recipients the sent ledger has as already sent this template
+    
+    Returns:
+        dict: The summary, or None if nothing was sent
+    """
     print("\n--- Itza Yerba Mate - Order Announcement Emails ---")
     
     # Get the Klaviyo order template ID
@@ -77,6 +89,38 @@ def send_announcement_emails(test_mode=False, specific_email=None, start_index=0
             print(f"Processing batch from index {start_index} to {end_index-1} ({len(batch_emails)} emails)")
             emails = batch_emails
     
+    # Skip recipients a previous run of this campaign already handled
+    checkpoint = None
+    skipped = 0
+    if not specific_email and not test_mode:
+        if resume and not campaign_id:
+            print("A campaign id is required to resume. Exiting.")
+            return
+        campaign_id = campaign_id or campaign_checkpoints.new_campaign_id('order')
+        checkpoint = campaign_checkpoints.CampaignCheckpoint(campaign_id)
+        
+        if resume:
+            if not checkpoint.exists():
+                print(f"No checkpoint found for campaign {campaign_id}, sending to everyone")
+            emails, skipped = checkpoint.pending(emails)
+            print(f"Resuming campaign {campaign_id}: skipping {skipped} recipients already processed, "
+                  f"{len(emails)} left")
+        elif checkpoint.exists():
+            print(f"Campaign {campaign_id} already has a checkpoint, use --resume {campaign_id} to continue it. Exiting.")
+            return
+        else:
+            print(f"Campaign id: {campaign_id} (if this run stops, continue it with --resume {campaign_id})")
+    
+    # Skip recipients any earlier run already sent this template to
+    ledger = sent_ledger.get_ledger()
+    ledger_key = sent_ledger.campaign_key('order', template_id)
+    already_sent = 0
+    if not specific_email and not resend:
+        emails, already_sent = ledger.unsent(ledger_key, emails)
+        if already_sent:
+            print(f"Skipping {already_sent} recipients already sent this campaign (use --resend to include them), "
+                  f"{len(emails)} left")
+    
     # Check if we're in test mode
     if test_mode:
         print("TEST MODE: No emails will be sent. Email addresses:")
@@ -84,45 +128,149 @@ def send_announcement_emails(test_mode=False, specific_email=None, start_index=0
             print(f"  {i+1}. {email}")
         return
     
-    # Send emails to each recipient
-    success_count = 0
-    failure_count = 0
-    queue_count = 0
+    # Send emails to each recipient, `concurrency` at a time but never faster than `rate` per second
+    stats = SendStats(len(emails))
+    pacer = rate_limit.TokenBucketLimiter('order_email', 1, rate, rate_limit.MemoryBucketBackend()) if rate else None
+    next_index = iter(range(len(emails)))
+    next_index_lock = threading.Lock()
     
-    for i, email in enumerate(emails):
-        print(f"\nProcessing {i+1}/{len(emails)}: {email}")
-        
-        # Prepare template variables
-        template_variables = {
-            "email": email,
-            "subject": "Itza Yerba Mate - Ordering is LIVE!",
-            "first_name": email.split('@')[0],  # Basic personalization
-            "order_url": "https://buy.stripe.com/8wM7tff4LfEg6EUbII"  # Update this with your actual order URL
-        }
-        
-        # Use Klaviyo to send the email
-        success, message = klaviyo_utils.send_order_announcement_email(email, template_id)
-        
-        if success:
-            success_count += 1
-            print(f"Successfully sent to {email}: {message}")
-        elif "queued" in str(message).lower():
-            queue_count += 1
-            print(f"Queued email for {email}: {message}")
-        else:
-            failure_count += 1
-            print(f"Failed to send to {email}: {message}")
-        
-        # Brief pause between sends to avoid rate limits
-        if i < len(emails) - 1:
-            time.sleep(1)
+    def worker():
+        while True:
+            with next_index_lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            if pacer:
+                wait_for_token(pacer)
+            with klaviyo_utils.bulk_sending():
+                send_one(emails[i], i, len(emails), template_id, stats, checkpoint, ledger, ledger_key)
+    
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, concurrency))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(timeout=progress_interval)
+            if thread.is_alive():
+                stats.print_progress()
+    stats.print_progress()
+    if checkpoint:
+        checkpoint.close()
     
     # Print summary
+    summary = stats.summary(concurrency=concurrency, rate=rate, start_index=start_index,
+                            campaign_id=campaign_id, skipped=skipped, already_sent=already_sent)
     print("\n--- Email Sending Summary ---")
-    print(f"Total emails: {len(emails)}")
-    print(f"Successfully sent: {success_count}")
-    print(f"Queued for later: {queue_count}")
-    print(f"Failed: {failure_count}")
+    print(f"Total emails: {summary['total']}")
+    print(f"Successfully sent: {summary['sent']}")
+    print(f"Queued for later: {summary['queued']}")
+    print(f"Failed: {summary['failed']}")
+    print(f"Elapsed: {summary['elapsed_seconds']:.1f}s ({summary['emails_per_second']:.2f} emails/s)")
+    
+    if summary_path:
+        write_summary(summary, summary_path)
+    return summary
+
+def wait_for_token(pacer):
+    """Block until the shared rate limit admits one more send"""
+    while True:
+        allowed, retry_after = pacer.allow('send')
+        if allowed:
+            return
+        time.sleep(retry_after)
+
+def send_one(email, i, total, template_id, stats, checkpoint=None, ledger=None, ledger_key=None):
+    """Send the announcement to one recipient and record the outcome (in the checkpoint and sent ledger too if given)"""
+    print(f"\nProcessing {i+1}/{total}: {email}")
+    
+    # Prepare template variables
+    template_variables = {
+        "email": email,
+        "subject": "Itza Yerba Mate - Ordering is LIVE!",
+        "first_name": email.split('@')[0],  # Basic personalization
+        "order_url": "https://buy.stripe.com/8wM7tff4LfEg6EUbII"  # Update this with your actual order URL
+    }
+    
+    # Use Klaviyo to send the email
+    try:
+        success, message = klaviyo_utils.send_order_announcement_email(email, template_id)
+    except Exception as e:
+        success, message = False, f"Error: {str(e)}"
+    
+    if success:
+        outcome = 'sent'
+        print(f"Successfully sent to {email}: {message}")
+    elif "queued" in str(message).lower():
+        outcome = 'queued'
+        print(f"Queued email for {email}: {message}")
+    else:
+        outcome = 'failed'
+        print(f"Failed to send to {email}: {message}")
+    
+    stats.record(outcome, email)
+    if checkpoint:
+        checkpoint.record(email, outcome)
+    if ledger:
+        try:
+            ledger.record(ledger_key, email, outcome)
+        except Exception as e:
+            print(f"Error recording {email} in the sent ledger: {str(e)}")
+
+class SendStats:
+    """Thread-safe counters for a send run, with progress and ETA"""
+    
+    def __init__(self, total):
+        self.total = total
+        self.counts = {'sent': 0, 'queued': 0, 'failed': 0}
+        self.failed_emails = []
+        self.started = time.time()
+        self.lock = threading.Lock()
+    
+    def record(self, outcome, email):
+        """Count one processed recipient"""
+        with self.lock:
+            self.counts[outcome] += 1
+            if outcome == 'failed':
+                self.failed_emails.append(email)
+    
+    def done(self):
+        """Number of recipients processed so far"""
+        return sum(self.counts.values())
+    
+    def print_progress(self):
+        """Print processed count, throughput and estimated time left"""
+        done = self.done()
+        elapsed = time.time() - self.started
+        rate = done / elapsed if elapsed > 0 else 0
+        eta = (self.total - done) / rate if rate else None
+        eta_text = f"{eta:.0f}s" if eta is not None else "unknown"
+        print(f"Progress: {done}/{self.total} ({done * 100 / max(self.total, 1):.1f}%) - "
+              f"sent {self.counts['sent']}, queued {self.counts['queued']}, failed {self.counts['failed']} - "
+              f"{rate:.2f} emails/s, ETA {eta_text}")
+    
+    def summary(self, **extra):
+        """Machine-readable summary of the run"""
+        elapsed = time.time() - self.started
+        return dict(
+            total=self.total,
+            sent=self.counts['sent'],
+            queued=self.counts['queued'],
+            failed=self.counts['failed'],
+            failed_emails=list(self.failed_emails),
+            elapsed_seconds=elapsed,
+            emails_per_second=self.done() / elapsed if elapsed > 0 else 0.0,
+            finished_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            **extra
+        )
+
+def write_summary(summary, path):
+    """Write the JSON summary to a file, or to stdout for '-'"""
+    if path == '-':
+        print(json.dumps(summary))
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    print(f"Wrote summary to {path}")
 
 def main():
     """Main function to parse command-line arguments and send emails"""
@@ -134,6 +282,17 @@ def main():
     parser.add_argument('--start', type=int, default=0, help='Starting index for batch processing')
     parser.add_argument('--batch', type=int, help='Number of emails to process in this batch')
     parser.add_argument('--process-queue', action='store_true', help='Process the email queue after sending')
+    parser.add_argument('--concurrency', type=int, default=1, help='Number of emails to send in parallel')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Optional cap on emails per second across all workers (0 for none, '
+                             'klaviyo_utils adapts to Klaviyo\'s limits on its own)')
+    parser.add_argument('--progress-interval', type=float, default=5.0, help='Seconds between progress lines')
+    parser.add_argument('--summary-json', type=str, help='Write a JSON summary to this file (- for stdout)')
+    parser.add_argument('--campaign', type=str, help='Id for this campaign\'s checkpoint (default: order-<timestamp>)')
+    parser.add_argument('--resume', type=str, metavar='CAMPAIGN',
+                        help='Resume a campaign, skipping recipients already sent or queued')
+    parser.add_argument('--resend', action='store_true',
+                        help='Also send to recipients the sent ledger has as already sent this template')
     
     args = parser.parse_args()
     
@@ -145,7 +304,14 @@ def main():
         test_mode=args.test,
         specific_email=args.email,
         start_index=args.start,
-        batch_size=args.batch
+        batch_size=args.batch,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        progress_interval=args.progress_interval,
+        summary_path=args.summary_json,
+        campaign_id=args.resume or args.campaign,
+        resume=bool(args.resume),
+        resend=args.resend
     )
     
     # Process the email queue if requested
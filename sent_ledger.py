@@ -0,0 +1,164 @@
+"""
+Itza Yerba Mate - Sent Ledger
+Persistent record of which campaign emails each recipient has been sent
+"""
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from waitlist_store import normalize_email
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LEDGER_DB_PATH = os.getenv('SENT_LEDGER_DB_PATH', os.path.join(BASE_DIR, 'emails', 'sent_ledger.db'))
+
+# Statuses that mean the recipient doesn't need the email again
+DELIVERED_STATUSES = ('sent', 'queued')
+# A 'sending' claim older than this is from a sender that died, and can be claimed again
+CLAIM_TIMEOUT = float(os.getenv('SENT_LEDGER_CLAIM_TIMEOUT', '600'))
+
+def campaign_key(campaign, template_id=None):
+    """Ledger key of a campaign: its name plus the template, so a new template is a new campaign"""
+    return f'{campaign}:{template_id}' if template_id else campaign
+
+class SentLedger:
+    """(campaign, normalized email) -> latest status and time, in SQLite
+
+    The primary key makes "was this already sent?" a single index lookup,
+    and the index on (campaign, status) serves the admin queries.
+    """
+
+    def __init__(self, db_path=LEDGER_DB_PATH):
+        self.db_path = db_path
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sent_ledger (
+                campaign TEXT NOT NULL,
+                email_normalized TEXT NOT NULL,
+                status TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                PRIMARY KEY (campaign, email_normalized)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sent_ledger_status ON sent_ledger (campaign, status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sent_ledger_email ON sent_ledger (email_normalized)")
+        conn.commit()
+
+    def connection(self):
+        """Get this thread's connection to the database"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            self.local.conn = conn
+        return conn
+
+    def record(self, campaign, email, status):
+        """Record the outcome of sending a campaign email ('sent', 'queued' or 'failed')"""
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sent_ledger (campaign, email_normalized, status, timestamp) VALUES (?, ?, ?, ?)",
+                (campaign, normalize_email(email), status, timestamp)
+            )
+
+    def claim(self, campaign, email):
+        """Atomically mark a recipient as 'sending' this campaign's email, unless already delivered
+
+        Two jobs for the same campaign can't both claim a recipient, so only
+        one of them sends. The sender records 'sent', 'queued' or 'failed'
+        afterwards, and a failed recipient can be claimed again.
+
+        Returns:
+            bool: True if this caller should send the email
+        """
+        now = datetime.now()
+        timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
+        stale = (now - timedelta(seconds=CLAIM_TIMEOUT)).strftime('%Y-%m-%d %H:%M:%S')
+        conn = self.connection()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO sent_ledger (campaign, email_normalized, status, timestamp) VALUES (?, ?, 'sending', ?) "
+                "ON CONFLICT (campaign, email_normalized) DO UPDATE SET status = 'sending', timestamp = excluded.timestamp "
+                f"WHERE sent_ledger.status NOT IN ({', '.join('?' * len(DELIVERED_STATUSES))}, 'sending') "
+                "OR (sent_ledger.status = 'sending' AND sent_ledger.timestamp < ?)",
+                (campaign, normalize_email(email), timestamp) + DELIVERED_STATUSES + (stale,)
+            )
+        return cursor.rowcount > 0
+
+    def status(self, campaign, email):
+        """Get the latest status of a campaign email to a recipient, or None"""
+        row = self.connection().execute(
+            "SELECT status FROM sent_ledger WHERE campaign = ? AND email_normalized = ?",
+            (campaign, normalize_email(email))
+        ).fetchone()
+        return row[0] if row else None
+
+    def already_sent(self, campaign, email):
+        """Whether the recipient already got (or has queued) this campaign's email"""
+        return self.status(campaign, email) in DELIVERED_STATUSES
+
+    def unsent(self, campaign, emails):
+        """Filter a recipient list down to those who haven't got this campaign's email
+
+        Returns:
+            tuple: (emails still to send, number skipped)
+        """
+        conn = self.connection()
+        delivered = {email for (email,) in conn.execute(
+            f"SELECT email_normalized FROM sent_ledger WHERE campaign = ? AND status IN ({', '.join('?' * len(DELIVERED_STATUSES))})",
+            (campaign,) + DELIVERED_STATUSES
+        )}
+        remaining = [email for email in emails if normalize_email(email) not in delivered]
+        return remaining, len(emails) - len(remaining)
+
+    def query(self, campaign=None, email=None, status=None, limit=100):
+        """Get ledger entries, newest first
+
+        Returns:
+            list: {'campaign', 'email', 'status', 'timestamp'} dicts
+        """
+        query = "SELECT campaign, email_normalized, status, timestamp FROM sent_ledger WHERE 1=1"
+        params = []
+        if campaign:
+            query += " AND campaign = ?"
+            params.append(campaign)
+        if email:
+            query += " AND email_normalized = ?"
+            params.append(normalize_email(email))
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        cursor = self.connection().execute(query + " ORDER BY timestamp DESC LIMIT ?", params + [limit])
+        return [{'campaign': campaign, 'email': email, 'status': status, 'timestamp': timestamp}
+                for campaign, email, status, timestamp in cursor]
+
+    def summary(self):
+        """Get the number of recipients per campaign and status
+
+        Returns:
+            dict: campaign -> {status: count}
+        """
+        cursor = self.connection().execute(
+            "SELECT campaign, status, COUNT(*) FROM sent_ledger GROUP BY campaign, status"
+        )
+        counts = {}
+        for campaign, status, count in cursor:
+            counts.setdefault(campaign, {})[status] = count
+        return counts
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+def get_ledger():
+    """Get the process-wide sent ledger"""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = SentLedger()
+        return _ledger
@@ -0,0 +1,95 @@
+"""
+Itza Yerba Mate - Waitlist Statistics
+Aggregates of the waitlist (totals, signups per hour and day, email domains) updated on every write
+"""
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+from waitlist_store import normalize_email, email_domain
+
+class WaitlistStats:
+    """Incrementally maintained waitlist aggregates
+
+    Signups are bucketed by their 'YYYY-MM-DD HH:MM:SS' timestamp into hour
+    and day counters, so windows over recent hours and days are a fixed
+    number of dict lookups however long the list gets.
+    """
+
+    def __init__(self, rows=()):
+        self.lock = threading.Lock()
+        self.signups = {}  # Normalized email -> signup timestamp
+        self.per_hour = Counter()  # 'YYYY-MM-DD HH' -> signups
+        self.per_day = Counter()  # 'YYYY-MM-DD' -> signups
+        self.domains = Counter()  # Email domain -> signups
+        for row in rows:
+            self.add(row['email'], row['timestamp'])
+
+    def add(self, email, timestamp):
+        """Count a signup (ignored if the email is already counted)"""
+        key = normalize_email(email)
+        with self.lock:
+            if key in self.signups:
+                return False
+            self.signups[key] = timestamp or ''
+            self.count(key, timestamp or '', 1)
+        return True
+
+    def remove(self, email):
+        """Uncount a signup"""
+        key = normalize_email(email)
+        with self.lock:
+            timestamp = self.signups.pop(key, None)
+            if timestamp is None:
+                return False
+            self.count(key, timestamp, -1)
+        return True
+
+    def count(self, key, timestamp, delta):
+        """Apply delta to every counter the signup falls in"""
+        for counter, bucket in ((self.per_hour, timestamp[:13]),
+                                (self.per_day, timestamp[:10]),
+                                (self.domains, email_domain(key))):
+            counter[bucket] += delta
+            if counter[bucket] <= 0:
+                del counter[bucket]
+
+    def snapshot(self, now=None, hours=24, days=30, top_domains=10):
+        """Get the current aggregates
+
+        Args:
+            now: Reference time, defaults to now (server local time like the timestamps)
+            hours: Number of hourly buckets to return, ending with the current hour
+            days: Number of daily buckets to return, ending with today
+            top_domains: Number of domains to return
+
+        Returns:
+            dict: Totals, per-hour and per-day series (oldest first), top domains and growth
+        """
+        now = now or datetime.now()
+        hour_keys = [(now - timedelta(hours=i)).strftime('%Y-%m-%d %H') for i in range(max(hours, 48) - 1, -1, -1)]
+        day_keys = [(now - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(max(days, 7) - 1, -1, -1)]
+
+        with self.lock:
+            total = len(self.signups)
+            hour_counts = [self.per_hour.get(key, 0) for key in hour_keys]
+            day_counts = [self.per_day.get(key, 0) for key in day_keys]
+            domains = self.domains.most_common(top_domains)
+
+        last_24_hours = sum(hour_counts[-24:])
+        previous_24_hours = sum(hour_counts[-48:-24])
+        return {
+            'total': total,
+            'last_24_hours': last_24_hours,
+            'last_7_days': sum(day_counts[-7:]),
+            'per_hour': [{'hour': key, 'count': count}
+                         for key, count in zip(hour_keys[-hours:], hour_counts[-hours:])],
+            'per_day': [{'day': key, 'count': count}
+                        for key, count in zip(day_keys[-days:], day_counts[-days:])],
+            'top_domains': [{'domain': domain, 'count': count} for domain, count in domains],
+            'growth': {
+                'last_24_hours': last_24_hours,
+                'previous_24_hours': previous_24_hours,
+                'rate': (last_24_hours - previous_24_hours) / previous_24_hours if previous_24_hours else None
+            }
+        }
@@ -0,0 +1,756 @@
+"""
+Itza Yerba Mate - Waitlist Storage
+Pluggable local storage engine for the waitlist (CSV file or SQLite database)
+"""
+import os
+import csv
+import sqlite3
+import argparse
+import bisect
+import threading
+import contextlib
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, fall back to the in-process lock only
+    fcntl = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Storage configuration
+WAITLIST_STORAGE = os.getenv('WAITLIST_STORAGE', 'csv')  # 'csv' or 'sqlite'
+CSV_PATH = os.getenv('WAITLIST_CSV_PATH', os.path.join(BASE_DIR, 'emails', 'waitlist.csv'))
+COMPACT_THRESHOLD = int(os.getenv('WAITLIST_COMPACT_THRESHOLD', '100'))  # Tombstones before compacting
+DB_PATH = os.getenv('WAITLIST_DB_PATH', os.path.join(BASE_DIR, 'emails', 'waitlist.db'))
+
+_store = None
+_store_lock = threading.Lock()
+
+def normalize_email(email):
+    """Normalize an email address for lookups"""
+    return email.strip().lower()
+
+def email_domain(email):
+    """Domain part of an email address, lowercased"""
+    return normalize_email(email).rpartition('@')[2]
+
+def tombstone_path_for(csv_path):
+    """Tombstone log that belongs to a CSV (waitlist.csv -> waitlist_tombstones.csv)"""
+    root, ext = os.path.splitext(csv_path)
+    return f'{root}_tombstones{ext or ".csv"}'
+
+TOMBSTONE_PATH = tombstone_path_for(CSV_PATH)
+
+def file_stamp(path):
+    """Cheap (size, mtime) version stamp of a file, None if it doesn't exist"""
+    try:
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+class CSVWaitlistStore:
+    """Waitlist stored in emails/waitlist.csv (email,timestamp rows)
+
+    Removals append a tombstone (email,removed_at,offset,file id) to an
+    append-only log instead of rewriting the CSV. The offset is the CSV's
+    size when the email was removed, so readers drop that email's rows that
+    start before it, and a signup right after the removal (even in the same
+    second) stays on the list. Tombstones for another file id are from
+    before a compaction and already folded in. Once COMPACT_THRESHOLD
+    tombstones have piled up a background compaction folds them into a
+    clean snapshot of the CSV. Writers hold an exclusive lock on a lock file
+    next to the CSV, so compaction can't drop rows or tombstones written by
+    other processes (the WAL drainer, send scripts, other workers).
+    """
+
+    def __init__(self, csv_path=CSV_PATH, tombstone_path=None, compact_threshold=COMPACT_THRESHOLD):
+        self.csv_path = csv_path
+        self.tombstone_path = tombstone_path or tombstone_path_for(csv_path)
+        self.compact_threshold = compact_threshold
+        self.lock = threading.RLock()
+        self.live = None  # Normalized emails currently on the list
+        self.live_stamp = None
+        self.tombstone_count = None
+        self.compacting = False
+        self.index = None  # Rows sorted by (timestamp, id) for query()
+        self.index_stamp = None
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Hold the in-process lock and the lock shared with other processes writing these files"""
+        with self.lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.csv_path)), exist_ok=True)
+            with open(self.csv_path + '.lock', 'w', encoding='utf-8') as f:
+                if fcntl:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def add(self, email, timestamp):
+        """Append an email to the waitlist"""
+        with self.locked():
+            # Keep the cached set only if nobody else wrote since it was loaded,
+            # never re-read the files just to append
+            stamp = self.stamp()
+            fresh = self.live is not None and self.live_stamp == stamp
+            index_fresh = self.index is not None and self.index_stamp == stamp
+            write_header = not os.path.exists(self.csv_path) or os.path.getsize(self.csv_path) == 0
+            with open(self.csv_path, 'a', encoding='utf-8') as f:
+                if write_header:
+                    f.write('email,timestamp\n')
+                f.write(f'{email},{timestamp}\n')
+            stamp = self.stamp()
+            if fresh:
+                self.live.add(normalize_email(email))
+                self.live_stamp = stamp
+            else:
+                self.live = None
+            if index_fresh:
+                self.index_insert(email, timestamp)
+                self.index_stamp = stamp
+            else:
+                self.index = None
+        return True
+
+    def stamp(self):
+        """Version stamp of the CSV and tombstone log together"""
+        return file_stamp(self.csv_path), file_stamp(self.tombstone_path)
+
+    def csv_position(self):
+        """(file id, size) of the CSV, recorded in a tombstone; (0, 0) if there is no CSV yet"""
+        try:
+            stat = os.stat(self.csv_path)
+            return stat.st_ino, stat.st_size
+        except FileNotFoundError:
+            return 0, 0
+
+    def read_tombstones(self, file_id):
+        """Get {normalized email: CSV offset it was removed at} for the CSV with this file id"""
+        tombstones = {}
+        count = 0
+        if os.path.exists(self.tombstone_path):
+            with open(self.tombstone_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    fields = line.strip().split(',')
+                    if not fields[0]:
+                        continue
+                    count += 1
+                    try:
+                        offset, tombstone_file_id = int(fields[2]), int(fields[3])
+                    except (IndexError, ValueError):
+                        continue
+                    if tombstone_file_id != file_id:
+                        continue
+                    email = normalize_email(fields[0])
+                    tombstones[email] = max(offset, tombstones.get(email, 0))
+        self.tombstone_count = count
+        return tombstones
+
+    def write_tombstones(self, emails):
+        """Append a tombstone for each normalized email at the current end of the CSV"""
+        file_id, offset = self.csv_position()
+        removed_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with open(self.tombstone_path, 'a', encoding='utf-8') as f:
+            f.write(''.join(f'{email},{removed_at},{offset},{file_id}\n' for email in emails))
+
+    def scan_rows(self, f):
+        """Yield (row number, email, timestamp, live) for every data row of the open CSV"""
+        tombstones = self.read_tombstones(os.fstat(f.fileno()).st_ino)
+        row_id = 0
+        for row_offset, fields in read_csv_lines(f):
+            row_id += 1
+            email = fields[0]
+            timestamp = fields[1] if len(fields) > 1 else ''
+            removed_offset = tombstones.get(normalize_email(email)) if email else None
+            yield row_id, email, timestamp, bool(email) and (removed_offset is None or row_offset >= removed_offset)
+
+    def iter_rows(self, start=None, end=None, domain=None):
+        """Yield live rows in file order, with their row number in the file as 'id'
+
+        Args:
+            start, end: Optional timestamp range, start <= timestamp < end
+            domain: Optional exact email domain
+        """
+        if not os.path.exists(self.csv_path):
+            return
+
+        domain = domain.strip().lower() if domain else None
+        with open(self.csv_path, 'rb') as f:
+            for row_id, email, timestamp, live in self.scan_rows(f):
+                if not live:
+                    continue
+                if (start and timestamp < start) or (end and timestamp >= end):
+                    continue
+                if domain and email_domain(email) != domain:
+                    continue
+                yield {'id': row_id, 'email': email, 'timestamp': timestamp}
+
+    def rows_since(self, watermark=None):
+        """Get live rows appended after a watermark, reading only the new end of the file
+
+        The watermark is the byte offset read up to and the line ending there.
+        If a compaction rewrote the file that line is looked up again, and if
+        it was dropped every row is returned.
+
+        Returns:
+            tuple: (rows as {'email', 'timestamp'} dicts, new watermark)
+        """
+        if not os.path.exists(self.csv_path):
+            return [], watermark
+
+        with self.lock:
+            with open(self.csv_path, 'rb') as f:
+                offset = self.find_watermark(f, watermark)
+                f.seek(offset)
+                lines = []
+                last_line = watermark['line'] if watermark and offset else ''
+                for raw_line in f:
+                    if not raw_line.endswith(b'\n'):
+                        break  # Partly written, picked up next time
+                    lines.append((offset, raw_line.decode('utf-8')))
+                    offset += len(raw_line)
+                    last_line = lines[-1][1]
+                tombstones = self.read_tombstones(os.fstat(f.fileno()).st_ino) if lines else {}
+
+        rows = []
+        for row_offset, line in lines:
+            row = next(csv.reader([line]), [])
+            if len(row) < 2 or '@' not in row[0]:
+                continue  # Header or malformed row
+            email, timestamp = row[0], row[1]
+            removed_offset = tombstones.get(normalize_email(email))
+            if removed_offset is not None and row_offset < removed_offset:
+                continue
+            rows.append({'email': email, 'timestamp': timestamp})
+        return rows, {'offset': offset, 'line': last_line}
+
+    def find_watermark(self, f, watermark):
+        """Byte offset of a rows_since watermark in the open CSV, 0 if it isn't there"""
+        if not watermark or not watermark.get('offset'):
+            return 0
+        offset = watermark['offset']
+        line = watermark['line'].encode('utf-8')
+        if offset >= len(line):
+            f.seek(offset - len(line))
+            if f.read(len(line)) == line:
+                return offset
+
+        # The file was rewritten, find the line in the new one
+        f.seek(0)
+        position = 0
+        for raw_line in f:
+            position += len(raw_line)
+            if raw_line == line:
+                return position
+        return 0
+
+    def read_rows(self):
+        """Get all live rows with their row number in the file as 'id'"""
+        return list(self.iter_rows())
+
+    def all(self):
+        """Get all live rows as a list of {'email', 'timestamp'} dicts"""
+        return [{'email': row['email'], 'timestamp': row['timestamp']} for row in self.read_rows()]
+
+    def indexed(self):
+        """Get the query index, built on first use and kept up to date by add and remove
+
+        It is rebuilt (a full parse) only when the files were written outside
+        this store object: another process, or a compaction.
+
+        Returns:
+            dict: {'all': (rows, keys), 'by_domain': {domain: (rows, keys)},
+            'by_email': {email: [keys]}, 'next_id': int} where rows are sorted by
+            (timestamp, id) and keys are those tuples
+        """
+        with self.lock:
+            stamp = self.stamp()
+            if self.index is None or stamp != self.index_stamp:
+                rows = []
+                next_id = 1
+                if os.path.exists(self.csv_path):
+                    with open(self.csv_path, 'rb') as f:
+                        for row_id, email, timestamp, live in self.scan_rows(f):
+                            next_id = row_id + 1
+                            if live:
+                                rows.append({'id': row_id, 'email': email, 'timestamp': timestamp})
+                rows.sort(key=lambda row: (row['timestamp'], row['id']))
+                self.index = {'all': ([], []), 'by_domain': {}, 'by_email': {}, 'next_id': next_id}
+                for row in rows:
+                    self.index_append(row)
+                self.index_stamp = stamp
+            return self.index
+
+    def index_append(self, row):
+        """Add a row that sorts after every indexed row to the index lists"""
+        key = (row['timestamp'], row['id'])
+        for rows, keys in (self.index['all'],
+                           self.index['by_domain'].setdefault(email_domain(row['email']), ([], []))):
+            rows.append(row)
+            keys.append(key)
+        self.index['by_email'].setdefault(normalize_email(row['email']), []).append(key)
+
+    def index_insert(self, email, timestamp):
+        """Add a row just appended to the CSV to the index"""
+        row = {'id': self.index['next_id'], 'email': email, 'timestamp': timestamp}
+        self.index['next_id'] += 1
+        key = (timestamp, row['id'])
+        for rows, keys in (self.index['all'], self.index['by_domain'].setdefault(email_domain(email), ([], []))):
+            position = bisect.bisect_right(keys, key)
+            rows.insert(position, row)
+            keys.insert(position, key)
+        self.index['by_email'].setdefault(normalize_email(email), []).append(key)
+
+    def index_remove(self, emails):
+        """Drop every row of some normalized emails from the index"""
+        for email in emails:
+            domain_lists = self.index['by_domain'].get(email_domain(email), ([], []))
+            for key in self.index['by_email'].pop(email, []):
+                for rows, keys in (self.index['all'], domain_lists):
+                    position = bisect.bisect_left(keys, key)
+                    if position < len(keys) and keys[position] == key:
+                        del rows[position]
+                        del keys[position]
+
+    def query(self, q=None, domain=None, start=None, end=None, sort='asc', after=None, limit=50):
+        """Get one page of rows matching the filters, ordered by (timestamp, id)
+
+        Args:
+            q: Optional substring the email must contain
+            domain: Optional exact email domain
+            start, end: Optional timestamp range, start <= timestamp < end
+            sort: 'asc' (oldest first) or 'desc' (newest first)
+            after: Optional (timestamp, id) key of the last row of the previous page
+            limit: Maximum rows to return
+
+        Returns:
+            tuple: (rows with 'id', total rows matching the filters)
+        """
+        index = self.indexed()
+        if domain:
+            rows, keys = index['by_domain'].get(domain.strip().lower(), ([], []))
+        else:
+            rows, keys = index['all']
+
+        lo = bisect.bisect_left(keys, (start, 0)) if start else 0
+        hi = bisect.bisect_left(keys, (end, 0)) if end else len(keys)
+        hi = max(lo, hi)
+
+        needle = q.strip().lower() if q else None
+        if needle:
+            total = sum(1 for row in rows[lo:hi] if needle in row['email'].lower())
+        else:
+            total = hi - lo
+
+        # Keyset pagination: continue strictly after the cursor row
+        if after:
+            after = tuple(after)
+            if sort == 'desc':
+                hi = min(hi, bisect.bisect_left(keys, after))
+            else:
+                lo = max(lo, bisect.bisect_right(keys, after))
+
+        page = []
+        candidates = range(hi - 1, lo - 1, -1) if sort == 'desc' else range(lo, hi)
+        for i in candidates:
+            if len(page) >= limit:
+                break
+            row = rows[i]
+            if needle and needle not in row['email'].lower():
+                continue
+            page.append(row)
+        return page, total
+
+    def live_emails(self):
+        """Get the set of live normalized emails, re-read only if the files changed"""
+        with self.lock:
+            stamp = self.stamp()
+            if self.live is None or stamp != self.live_stamp:
+                self.live = {normalize_email(row['email']) for row in self.all()}
+                self.live_stamp = stamp
+            return self.live
+
+    def emails(self):
+        """Get all email addresses"""
+        return [row['email'] for row in self.all() if '@' in row['email']]
+
+    def contains(self, email):
+        """Check whether an email is on the waitlist"""
+        return normalize_email(email) in self.live_emails()
+
+    def between(self, start=None, end=None):
+        """Get rows with start <= timestamp < end ('YYYY-MM-DD HH:MM:SS' strings)"""
+        return [row for row in self.all()
+                if (start is None or row['timestamp'] >= start)
+                and (end is None or row['timestamp'] < end)]
+
+    def remove(self, email_to_remove):
+        """Remove an email by appending a tombstone to the log"""
+        email = normalize_email(email_to_remove)
+        with self.locked():
+            index_fresh = self.index is not None and self.index_stamp == self.stamp()
+            live = self.live_emails()
+            if email not in live:
+                print(f"Email not found: {email_to_remove}")
+                return False
+
+            self.write_tombstones([email])
+            live.discard(email)
+            self.live_stamp = self.stamp()
+            self.update_index_after_removal(index_fresh, [email])
+            if self.tombstone_count is not None:
+                self.tombstone_count += 1
+            print(f"Removed email: {email_to_remove}")
+
+            if (self.tombstone_count or 0) >= self.compact_threshold and not self.compacting:
+                self.compacting = True
+                threading.Thread(target=self.compact, daemon=True).start()
+
+        return True
+
+    def update_index_after_removal(self, index_fresh, emails):
+        """Drop removed emails from the query index if it was up to date, else let it rebuild"""
+        if index_fresh:
+            self.index_remove(emails)
+            self.index_stamp = self.live_stamp
+        else:
+            self.index = None
+
+    def remove_many(self, emails):
+        """Remove several emails with a single append to the tombstone log
+
+        Returns:
+            set: normalized emails that were on the list and are now removed
+        """
+        with self.locked():
+            index_fresh = self.index is not None and self.index_stamp == self.stamp()
+            live = self.live_emails()
+            removed = {normalize_email(email) for email in emails} & live
+            if not removed:
+                return removed
+
+            self.write_tombstones(sorted(removed))
+            live.difference_update(removed)
+            self.live_stamp = self.stamp()
+            self.update_index_after_removal(index_fresh, removed)
+            if self.tombstone_count is not None:
+                self.tombstone_count += len(removed)
+            print(f"Removed {len(removed)} emails")
+
+            if (self.tombstone_count or 0) >= self.compact_threshold and not self.compacting:
+                self.compacting = True
+                threading.Thread(target=self.compact, daemon=True).start()
+
+        return removed
+
+    def compact(self):
+        """Fold the tombstones into a clean snapshot of the CSV and clear the log
+
+        Returns:
+            int: number of rows dropped
+        """
+        with self.locked():
+            try:
+                if not os.path.exists(self.csv_path):
+                    return 0
+
+                with open(self.csv_path, 'r', encoding='utf-8') as f:
+                    total = sum(1 for row in csv.DictReader(f) if row.get('email'))
+                rows = self.all()
+
+                temp_path = self.csv_path + '.temp'
+                with open(temp_path, 'w', encoding='utf-8', newline='') as f:
+                    writer = csv.DictWriter(f, fieldnames=['email', 'timestamp'], lineterminator='\n')
+                    writer.writeheader()
+                    writer.writerows(rows)
+                os.replace(temp_path, self.csv_path)
+
+                # The snapshot is a new file id, so a crash before this truncate
+                # leaves tombstones that no longer match it
+                open(self.tombstone_path, 'w', encoding='utf-8').close()
+                self.tombstone_count = 0
+                self.live_stamp = self.stamp()
+
+                print(f"Compacted waitlist: dropped {total - len(rows)} removed rows")
+                return total - len(rows)
+            finally:
+                self.compacting = False
+
+def read_csv_lines(f):
+    """Yield (byte offset, fields) of each data row of a waitlist CSV opened in binary mode"""
+    offset = 0
+    for line_number, raw_line in enumerate(f):
+        row_offset = offset
+        offset += len(raw_line)
+        if line_number == 0:
+            continue  # Header
+        fields = next(csv.reader([raw_line.decode('utf-8')]), [])
+        if fields:
+            yield row_offset, fields
+
+# Expression for the email domain, used by the domain index and by queries so they match it
+DOMAIN_SQL = "substr(email_normalized, instr(email_normalized, '@') + 1)"
+
+class SQLiteWaitlistStore:
+    """Waitlist stored in a SQLite database in WAL mode
+
+    Lookups, removals and date-range queries use the unique index on the
+    normalized email and the index on the signup timestamp.
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS waitlist (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT NOT NULL,
+                email_normalized TEXT NOT NULL,
+                timestamp TEXT NOT NULL
+            )
+        """)
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_waitlist_email ON waitlist (email_normalized)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_waitlist_timestamp ON waitlist (timestamp)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_waitlist_domain ON waitlist ({DOMAIN_SQL}, timestamp)")
+        conn.commit()
+
+    def connection(self):
+        """Get this thread's connection to the database"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def stamp(self):
+        """Version stamp of the database and its write-ahead log together"""
+        return file_stamp(self.db_path), file_stamp(self.db_path + '-wal')
+
+    def add(self, email, timestamp):
+        """Add an email to the waitlist (ignored if already present)"""
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO waitlist (email, email_normalized, timestamp) VALUES (?, ?, ?)",
+                (email, normalize_email(email), timestamp)
+            )
+        return True
+
+    def all(self):
+        """Get all rows as a list of {'email', 'timestamp'} dicts in signup order"""
+        cursor = self.connection().execute("SELECT email, timestamp FROM waitlist ORDER BY id")
+        return [{'email': email, 'timestamp': timestamp} for email, timestamp in cursor]
+
+    def emails(self):
+        """Get all email addresses"""
+        cursor = self.connection().execute("SELECT email FROM waitlist ORDER BY id")
+        return [email for (email,) in cursor]
+
+    def contains(self, email):
+        """Check whether an email is on the waitlist"""
+        cursor = self.connection().execute(
+            "SELECT 1 FROM waitlist WHERE email_normalized = ?", (normalize_email(email),)
+        )
+        return cursor.fetchone() is not None
+
+    def between(self, start=None, end=None):
+        """Get rows with start <= timestamp < end ('YYYY-MM-DD HH:MM:SS' strings)"""
+        query = "SELECT email, timestamp FROM waitlist WHERE 1=1"
+        params = []
+        if start is not None:
+            query += " AND timestamp >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND timestamp < ?"
+            params.append(end)
+        cursor = self.connection().execute(query + " ORDER BY timestamp", params)
+        return [{'email': email, 'timestamp': timestamp} for email, timestamp in cursor]
+
+    def iter_rows(self, start=None, end=None, domain=None):
+        """Yield rows in signup order without loading them all
+
+        Args:
+            start, end: Optional timestamp range, start <= timestamp < end
+            domain: Optional exact email domain
+        """
+        query = "SELECT id, email, timestamp FROM waitlist WHERE 1=1"
+        params = []
+        if start:
+            query += " AND timestamp >= ?"
+            params.append(start)
+        if end:
+            query += " AND timestamp < ?"
+            params.append(end)
+        if domain:
+            query += f" AND {DOMAIN_SQL} = ?"
+            params.append(domain.strip().lower())
+        # A separate connection so the cursor isn't reset by other queries on this thread
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            for row_id, email, timestamp in conn.execute(query + " ORDER BY id", params):
+                yield {'id': row_id, 'email': email, 'timestamp': timestamp}
+        finally:
+            conn.close()
+
+    def rows_since(self, watermark=None):
+        """Get rows added after a watermark (the last row id returned)
+
+        Returns:
+            tuple: (rows as {'email', 'timestamp'} dicts, new watermark)
+        """
+        last_id = (watermark or {}).get('id', 0)
+        cursor = self.connection().execute(
+            "SELECT id, email, timestamp FROM waitlist WHERE id > ? ORDER BY id", (last_id,)
+        )
+        rows = []
+        for row_id, email, timestamp in cursor:
+            last_id = row_id
+            rows.append({'email': email, 'timestamp': timestamp})
+        return rows, {'id': last_id}
+
+    def query(self, q=None, domain=None, start=None, end=None, sort='asc', after=None, limit=50):
+        """Get one page of rows matching the filters, ordered by (timestamp, id)
+
+        Args:
+            q: Optional substring the email must contain
+            domain: Optional exact email domain
+            start, end: Optional timestamp range, start <= timestamp < end
+            sort: 'asc' (oldest first) or 'desc' (newest first)
+            after: Optional (timestamp, id) key of the last row of the previous page
+            limit: Maximum rows to return
+
+        Returns:
+            tuple: (rows with 'id', total rows matching the filters)
+        """
+        where = []
+        params = []
+        if domain:
+            where.append(f"{DOMAIN_SQL} = ?")
+            params.append(domain.strip().lower())
+        if start:
+            where.append("timestamp >= ?")
+            params.append(start)
+        if end:
+            where.append("timestamp < ?")
+            params.append(end)
+        if q:
+            where.append("instr(email_normalized, ?) > 0")
+            params.append(q.strip().lower())
+
+        conn = self.connection()
+        where_sql = (" WHERE " + " AND ".join(where)) if where else ""
+        total = conn.execute("SELECT COUNT(*) FROM waitlist" + where_sql, params).fetchone()[0]
+
+        page_where = list(where)
+        page_params = list(params)
+        if after:
+            operator = '<' if sort == 'desc' else '>'
+            page_where.append(f"(timestamp, id) {operator} (?, ?)")
+            page_params.extend(after)
+        order = "DESC" if sort == 'desc' else "ASC"
+        page_sql = (" WHERE " + " AND ".join(page_where)) if page_where else ""
+        cursor = conn.execute(
+            f"SELECT id, email, timestamp FROM waitlist{page_sql} ORDER BY timestamp {order}, id {order} LIMIT ?",
+            page_params + [limit]
+        )
+        rows = [{'id': row_id, 'email': email, 'timestamp': timestamp} for row_id, email, timestamp in cursor]
+        return rows, total
+
+    def remove(self, email_to_remove):
+        """Remove an email from the waitlist"""
+        conn = self.connection()
+        with conn:
+            cursor = conn.execute(
+                "DELETE FROM waitlist WHERE email_normalized = ?", (normalize_email(email_to_remove),)
+            )
+        return cursor.rowcount > 0
+
+    def remove_many(self, emails):
+        """Remove several emails in one transaction
+
+        Returns:
+            set: normalized emails that were on the list and are now removed
+        """
+        removed = set()
+        conn = self.connection()
+        with conn:
+            for email in {normalize_email(email) for email in emails}:
+                cursor = conn.execute("DELETE FROM waitlist WHERE email_normalized = ?", (email,))
+                if cursor.rowcount > 0:
+                    removed.add(email)
+        return removed
+
+    def import_rows(self, rows):
+        """Bulk insert {'email', 'timestamp'} rows, skipping duplicates
+
+        Returns:
+            int: number of rows inserted
+        """
+        conn = self.connection()
+        with conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO waitlist (email, email_normalized, timestamp) VALUES (?, ?, ?)",
+                ((row['email'], normalize_email(row['email']), row['timestamp'])
+                 for row in rows if row.get('email') and '@' in row['email'])
+            )
+            return conn.total_changes - before
+
+def get_store():
+    """Get the configured waitlist store (created once per process)"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if WAITLIST_STORAGE == 'sqlite':
+                _store = SQLiteWaitlistStore()
+            else:
+                _store = CSVWaitlistStore()
+        return _store
+
+def import_csv_to_sqlite(csv_path=CSV_PATH, db_path=DB_PATH, tombstone_path=None):
+    """One-shot import of the CSV waitlist into the SQLite database
+
+    Args:
+        csv_path: CSV to import
+        db_path: SQLite database to import into
+        tombstone_path: Tombstone log of the CSV (default: derived from csv_path)
+
+    Returns:
+        tuple: (rows read, rows inserted)
+    """
+    rows = CSVWaitlistStore(csv_path, tombstone_path).all()  # Tombstones already applied
+    inserted = SQLiteWaitlistStore(db_path).import_rows(rows)
+    print(f"Imported {inserted} of {len(rows)} emails from {csv_path} into {db_path}")
+    return len(rows), inserted
+
+def main():
+    """Main function to parse command-line arguments"""
+    parser = argparse.ArgumentParser(description='Manage the local waitlist storage')
+    parser.add_argument('--import-csv', action='store_true', help='Import emails/waitlist.csv into the SQLite database')
+    parser.add_argument('--compact', action='store_true', help='Fold removal tombstones into a clean waitlist.csv')
+    parser.add_argument('--csv', type=str, default=CSV_PATH, help='CSV file to import from or compact')
+    parser.add_argument('--tombstones', type=str,
+                        help='Tombstone log of the CSV (default: <csv name>_tombstones.csv next to it)')
+    parser.add_argument('--db', type=str, default=DB_PATH, help='SQLite database to import into')
+
+    args = parser.parse_args()
+
+    if args.import_csv:
+        import_csv_to_sqlite(args.csv, args.db, args.tombstones)
+    elif args.compact:
+        CSVWaitlistStore(args.csv, args.tombstones).compact()
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Itza Yerba Mate - Waitlist Write-Ahead Log
+Append-only, fsync'd log of signups accepted in surge mode, replayed by process_waitlist_wal.py
+"""
+import os
+import json
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, fall back to the in-process lock only
+    fcntl = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+WAL_PATH = os.getenv('WAITLIST_WAL_PATH', os.path.join(BASE_DIR, 'emails', 'waitlist.wal'))
+
+_wal_lock = threading.Lock()
+
+def offset_path(wal_path=WAL_PATH):
+    """File holding the byte offset the drainer has replayed up to"""
+    return wal_path + '.offset'
+
+@contextlib.contextmanager
+def locked_wal(wal_path, mode):
+    """Open the log holding an exclusive lock (shared by appenders and the drainer)"""
+    with _wal_lock:
+        os.makedirs(os.path.dirname(wal_path), exist_ok=True)
+        with open(wal_path, mode, encoding='utf-8') as f:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield f
+            finally:
+                if fcntl:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def append(entry, wal_path=WAL_PATH):
+    """Durably append an entry (a JSON-serializable dict) to the log
+
+    Returns once the entry has been fsync'd to disk.
+    """
+    line = json.dumps(entry, separators=(',', ':')) + '\n'
+    with locked_wal(wal_path, 'a') as f:
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+
+def read_offset(wal_path=WAL_PATH):
+    """Get the byte offset the drainer has replayed up to"""
+    try:
+        with open(offset_path(wal_path), 'r', encoding='utf-8') as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def write_offset(offset, wal_path=WAL_PATH):
+    """Persist the replayed offset atomically"""
+    path = offset_path(wal_path)
+    temp_path = path + '.temp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(str(offset))
+    os.replace(temp_path, path)
+
+def read_pending(wal_path=WAL_PATH, limit=None):
+    """Get entries not replayed yet
+
+    Returns:
+        list: (end offset, entry dict) tuples in log order
+    """
+    entries = []
+    if not os.path.exists(wal_path):
+        return entries
+
+    offset = read_offset(wal_path)
+    with open(wal_path, 'rb') as f:
+        f.seek(offset)
+        for raw_line in f:
+            if not raw_line.endswith(b'\n'):
+                break  # Partially written entry, picked up next time
+            offset += len(raw_line)
+            try:
+                entries.append((offset, json.loads(raw_line)))
+            except ValueError:
+                print(f"Skipping unreadable WAL entry at offset {offset}")
+                continue
+            if limit and len(entries) >= limit:
+                break
+    return entries
+
+def pending_count(wal_path=WAL_PATH):
+    """Number of entries not replayed yet"""
+    return len(read_pending(wal_path))
+
+def truncate_if_drained(wal_path=WAL_PATH):
+    """Empty the log once everything in it has been replayed
+
+    Appenders write with O_APPEND under the same lock, so nothing written
+    after the check is lost.
+    """
+    if not os.path.exists(wal_path):
+        return False
+
+    with locked_wal(wal_path, 'a') as f:
+        if os.path.getsize(wal_path) != read_offset(wal_path):
+            return False
+        f.truncate(0)
+        write_offset(0, wal_path)
+    return True